@@ -0,0 +1,612 @@
+"""
+reclassify.py 离线性能基准
+
+- generate: 生成与 zubo_all.txt 格式相同的合成直播源（默认 1k / 10k / 100k 个频道）
+- serve:    启动本地模拟 udpxy 转发服务器（可配置延迟、失效主机，返回真实的 MPEG-TS 包）
+- run:      对 parse_groups / normalize_channel_name / categorize_channels / filter_valid_groups
+            逐阶段测量吞吐量（行/秒、探测/秒），可与之前保存的基准结果比较
+- check:    回归检查：对固定的 tests/golden/reclassify.txt 重新分类，与 tests/golden/result.txt 逐字节比较
+            （忽略文件头），并与之前保存的基准结果比较各阶段吞吐量；任一项不通过时退出码为1，
+            修改分类规则或优化分类代码后运行
+
+不访问任何外部直播源，所有探测都指向本地模拟服务器
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import reclassify
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_PROBE_SIZES = (1000,)
+CHANNELS_PER_GROUP = 40
+# 合成频道中无法识别的名称比例（会进入"其他频道"）
+UNKNOWN_NAME_RATIO = 0.1
+PROVINCES = ["北京", "上海", "天津", "重庆", "河北", "山西", "辽宁", "吉林", "江苏", "浙江", "安徽", "福建",
+             "江西", "山东", "河南", "湖北", "湖南", "广东", "广西", "海南", "四川", "贵州", "云南", "陕西"]
+OPERATORS = ["电信", "联通", "移动"]
+
+# 模拟转发服务器默认参数
+FAKE_RELAY_HOSTS = 32
+FAKE_RELAY_DEAD_RATIO = 0.25
+FAKE_RELAY_LATENCY = 0.02
+FAKE_RELAY_JITTER = 0.01
+# 有效主机持续推送TS数据的最长时间（秒），探测读够数据后会主动断开
+FAKE_RELAY_STREAM_SECONDS = 2
+FAKE_RELAY_CHUNK_PACKETS = 7
+
+BENCHMARK_RESULT_FILE = "benchmark.json"
+
+# 回归检查：固定的输入和期望结果，定时任务只更新仓库根目录的 reclassify.txt/result.txt，不会改动它们
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(REPO_DIR, "tests", "golden")
+GOLDEN_INPUT_FILE = os.path.join(GOLDEN_DIR, "reclassify.txt")
+GOLDEN_RESULT_FILE = os.path.join(GOLDEN_DIR, "result.txt")
+CHECK_SIZE = 10000
+# 各阶段吞吐量下限（行/秒），约为开发机实测值的1/5；低于下限时检查失败，较慢的机器可用 --advisory-budgets 改为只提示
+THROUGHPUT_BUDGETS = {
+    'parse_groups': 100000,
+    'normalize_channel_name': 100000,
+    'categorize_channels': 10000,
+    'reclassify_txt': 5000,
+}
+# 与基准结果比较时允许的最大吞吐量下降比例
+MAX_REGRESSION = 0.3
+# 分类不一致时每类差异最多列出的频道行数
+CHECK_DIFF_EXAMPLES = 10
+
+# ---------------------------------------------------------------- 合成直播源
+
+def build_name_pool(unknown_ratio=UNKNOWN_NAME_RATIO, seed=0):
+    """频道名称池：CHANNEL_NAME_MAPPING中的所有变体、各分类中的名称，以及一部分无法识别的名称"""
+    names = []
+    for variants in reclassify.CHANNEL_NAME_MAPPING.values():
+        names.extend(variants)
+    for category_names in reclassify.CATEGORY_MAPPING.values():
+        names.extend(category_names)
+    names = list(dict.fromkeys(names))
+
+    rng = random.Random(seed)
+    unknown_count = int(len(names) * unknown_ratio / max(1e-9, 1 - unknown_ratio))
+    names.extend(f"{rng.choice(PROVINCES)}测试频道{i}" for i in range(unknown_count))
+    return names
+
+def synthetic_hosts(count, seed=0):
+    """合成的转发服务器地址（只用于解析和分类测试，不会被探测）"""
+    rng = random.Random(seed)
+    return [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}:"
+            f"{rng.choice((4022, 8888, 7088, 9999))}" for _ in range(count)]
+
+def iter_playlist_lines(channel_count, hosts, channels_per_group=CHANNELS_PER_GROUP, seed=0):
+    """
+    逐行生成合成直播源，格式与 zubo_all.txt 相同：
+    前两行为更新时间，之后每个分组一行"地区运营商-组播,#genre#"，分组内为"频道名称,播放地址"
+    每个分组固定使用一个转发服务器
+    """
+    rng = random.Random(seed)
+    names = build_name_pool(seed=seed)
+
+    yield "更新时间,#genre#"
+    yield f"{datetime.now(reclassify.BEIJING_TZ).strftime('%Y-%m-%d %H:%M:%S')},http://127.0.0.1/update"
+
+    group_index = 0
+    emitted = 0
+    while emitted < channel_count:
+        host = hosts[group_index % len(hosts)]
+        province = PROVINCES[group_index % len(PROVINCES)]
+        operator = OPERATORS[group_index // len(PROVINCES) % len(OPERATORS)]
+        group_name = f"{province}{operator}{group_index // (len(PROVINCES) * len(OPERATORS)) + 1}-组播"
+        yield f"{group_name},#genre#"
+        size = min(channels_per_group, channel_count - emitted)
+        for _ in range(size):
+            multicast = f"239.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+            yield f"{rng.choice(names)},http://{host}/rtp/{multicast}:{rng.randint(1024, 65535)}"
+        emitted += size
+        group_index += 1
+
+def write_playlist(path, channel_count, hosts=None, seed=0):
+    """把合成直播源写入文件，返回行数"""
+    hosts = hosts or synthetic_hosts(max(1, channel_count // (CHANNELS_PER_GROUP * 4)), seed)
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in iter_playlist_lines(channel_count, hosts, seed=seed):
+            f.write(line)
+            f.write('\n')
+            count += 1
+    return count
+
+# ---------------------------------------------------------------- MPEG-TS 数据
+
+def crc32_mpeg(data):
+    """MPEG-2 PSI 使用的CRC32（多项式0x04C11DB7，不反转）"""
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+def ts_packet(pid, payload, continuity=0, payload_start=False):
+    """组装一个188字节的TS包，负载不足时用0xFF填充"""
+    header = bytes((
+        0x47,
+        (0x40 if payload_start else 0) | ((pid >> 8) & 0x1F),
+        pid & 0xFF,
+        0x10 | (continuity & 0x0F),
+    ))
+    packet = header + payload
+    return packet + b'\xff' * (reclassify.TS_PACKET_SIZE - len(packet))
+
+def psi_section(table_id, table_id_extension, body):
+    """组装带CRC的PSI表（PAT/PMT），前面带pointer_field"""
+    section_length = 5 + len(body) + 4
+    section = bytes((
+        table_id,
+        0xB0 | ((section_length >> 8) & 0x0F),
+        section_length & 0xFF,
+        (table_id_extension >> 8) & 0xFF,
+        table_id_extension & 0xFF,
+        0xC1,
+        0x00,
+        0x00,
+    )) + body
+    return b'\x00' + section + crc32_mpeg(section).to_bytes(4, 'big')
+
+def build_ts_chunk(packets=FAKE_RELAY_CHUNK_PACKETS, program_number=1, pmt_pid=0x1000, video_pid=0x100):
+    """
+    一段真实的TS数据：PAT + PMT（一路H.264视频）+ 若干视频PID的空负载包，
+    与udpxy转发的组播流开头结构一致
+    """
+    pat = psi_section(0x00, 1, bytes((
+        (program_number >> 8) & 0xFF, program_number & 0xFF,
+        0xE0 | ((pmt_pid >> 8) & 0x1F), pmt_pid & 0xFF,
+    )))
+    pmt = psi_section(0x02, program_number, bytes((
+        0xE0 | ((video_pid >> 8) & 0x1F), video_pid & 0xFF,
+        0xF0, 0x00,
+        0x1B, 0xE0 | ((video_pid >> 8) & 0x1F), video_pid & 0xFF, 0xF0, 0x00,
+    )))
+    chunk = [ts_packet(0, pat, payload_start=True), ts_packet(pmt_pid, pmt, payload_start=True)]
+    for continuity in range(max(0, packets - 2)):
+        chunk.append(ts_packet(video_pid, b'', continuity))
+    return b''.join(chunk)
+
+# ---------------------------------------------------------------- 模拟转发服务器
+
+class FakeRelayServer:
+    """
+    模拟udpxy转发服务器：每个"主机"是本地的一个端口
+    有效主机在延迟后返回200和持续的TS数据；失效主机按dead_mode接受连接后挂起（hang）或立即断开（reset）
+    在后台线程的事件循环中运行
+    """
+
+    def __init__(self, hosts=FAKE_RELAY_HOSTS, dead_ratio=FAKE_RELAY_DEAD_RATIO, latency=FAKE_RELAY_LATENCY,
+                 jitter=FAKE_RELAY_JITTER, dead_mode='reset', stream_seconds=FAKE_RELAY_STREAM_SECONDS, seed=0):
+        self.host_count = hosts
+        self.dead_count = int(hosts * dead_ratio)
+        self.latency = latency
+        self.jitter = jitter
+        self.dead_mode = dead_mode
+        self.stream_seconds = stream_seconds
+        self.rng = random.Random(seed)
+        self.chunk = build_ts_chunk()
+        self.hosts = []
+        self.dead_hosts = set()
+        self.requests = 0
+        self.loop = None
+        self.thread = None
+        self.servers = []
+
+    async def handle(self, reader, writer, dead):
+        self.requests += 1
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            if dead:
+                if self.dead_mode == 'hang':
+                    # 不返回任何数据，直到客户端超时断开
+                    await reader.read()
+                return
+
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                         b"Connection: close\r\n\r\n")
+            deadline = time.monotonic() + self.stream_seconds
+            while time.monotonic() < deadline:
+                writer.write(self.chunk)
+                await writer.drain()
+                await asyncio.sleep(0.005)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.LimitOverrunError, asyncio.CancelledError):
+            # 客户端断开或服务器关闭
+            pass
+        finally:
+            writer.close()
+
+    async def start_servers(self):
+        for index in range(self.host_count):
+            dead = index < self.dead_count
+            server = await asyncio.start_server(
+                lambda reader, writer, dead=dead: self.handle(reader, writer, dead), '127.0.0.1', 0, backlog=1024
+            )
+            port = server.sockets[0].getsockname()[1]
+            host = f"127.0.0.1:{port}"
+            self.hosts.append(host)
+            if dead:
+                self.dead_hosts.add(host)
+            self.servers.append(server)
+
+    def start(self):
+        """在后台线程中启动所有端口，返回主机地址列表"""
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start_servers())
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name="fake-relay", daemon=True)
+        self.thread.start()
+        ready.wait()
+        # 打乱顺序，使失效主机分散在各个分组中
+        self.rng.shuffle(self.hosts)
+        return self.hosts
+
+    def stop(self):
+        if self.loop is None:
+            return
+
+        async def close_servers():
+            for server in self.servers:
+                server.close()
+            # 结束仍挂起的连接，避免事件循环关闭后残留任务
+            pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(close_servers(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+# ---------------------------------------------------------------- 基准测试
+
+def measure(function, repeat=3):
+    """运行repeat次，返回最短耗时和最后一次的结果"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def stage_result(count, seconds, unit):
+    return {
+        'count': count,
+        'seconds': round(seconds, 4),
+        f'{unit}_per_sec': round(count / seconds, 1) if seconds > 0 else None,
+    }
+
+def bench_cpu_stages(channel_count, repeat=3, seed=0):
+    """解析、标准化和分类阶段的吞吐量（不涉及网络）"""
+    hosts = synthetic_hosts(max(1, channel_count // (CHANNELS_PER_GROUP * 4)), seed)
+    lines = list(iter_playlist_lines(channel_count, hosts, seed=seed))
+    results = {}
+
+    seconds, groups = measure(
+        lambda: reclassify.parse_groups(reclassify.iter_content_lines(lines)), repeat)
+    results['parse_groups'] = stage_result(len(lines), seconds, 'lines')
+
+    names = [channel.name for channels in groups.values() for channel in channels]
+    seconds, _ = measure(lambda: [reclassify.normalize_channel_name(name) for name in names], repeat)
+    results['normalize_channel_name'] = stage_result(len(names), seconds, 'lines')
+
+    formatted_channels = list(reclassify.iter_output_lines(groups))
+    seconds, _ = measure(lambda: reclassify.categorize_channels(formatted_channels), repeat)
+    results['categorize_channels'] = stage_result(len(formatted_channels), seconds, 'lines')
+    return results
+
+def bench_probe_stage(channel_count, relay, per_channel=True, max_concurrency=reclassify.MAX_CONCURRENT_PROBES,
+                      per_host_limit=reclassify.MAX_PROBES_PER_HOST, seed=0):
+    """有效性检测阶段的吞吐量：所有探测都指向本地模拟转发服务器，不使用探测缓存"""
+    lines = list(iter_playlist_lines(channel_count, relay.hosts, seed=seed))
+    groups = reclassify.parse_groups(reclassify.iter_content_lines(lines))
+    metrics = reclassify.Metrics()
+
+    started = time.perf_counter()
+    valid_groups = reclassify.filter_valid_groups(
+        groups, max_concurrency, per_host_limit, dedupe_hosts=not per_channel, per_channel=per_channel,
+        metrics=metrics)
+    seconds = time.perf_counter() - started
+
+    result = stage_result(len(metrics.latencies), seconds, 'probes')
+    result.update({
+        'channels': channel_count,
+        'groups': len(groups),
+        'valid_groups': len(valid_groups),
+        'probe_latency': metrics.latency_summary(),
+        'probe_outcomes': dict(metrics.outcomes),
+    })
+    return result
+
+def compare_with_baseline(results, baseline):
+    """打印与基准结果的吞吐量比值（>1表示更快）"""
+    for size, stages in results.items():
+        for stage, current in stages.items():
+            previous = baseline.get(size, {}).get(stage)
+            if not previous:
+                continue
+            for key, value in current.items():
+                if key.endswith('_per_sec') and value and previous.get(key):
+                    print(f"  {size:>8} {stage:<24} {value / previous[key]:6.2f}x  "
+                          f"({previous[key]:.1f} -> {value:.1f} {key})")
+
+def print_results(results):
+    for size, stages in results.items():
+        print(f"== {size} 个频道 ==")
+        for stage, result in stages.items():
+            rate_key = next(key for key in result if key.endswith('_per_sec'))
+            print(f"  {stage:<24} {result['count']:>8} 项  {result['seconds']:>9.4f} 秒  "
+                  f"{result[rate_key] or 0:>12.1f} {rate_key}")
+
+def run(args):
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = bench_cpu_stages(size, args.repeat, args.seed)
+
+    if args.probe_sizes:
+        with FakeRelayServer(args.hosts, args.dead_ratio, args.latency, args.jitter, args.dead_mode,
+                             seed=args.seed) as relay:
+            for size in args.probe_sizes:
+                results.setdefault(str(size), {})['filter_valid_groups'] = bench_probe_stage(
+                    size, relay, args.probe_mode == 'channel', args.concurrency, args.per_host, args.seed)
+
+    print_results(results)
+
+    if args.baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f).get('results', {})
+            print(f"与基准 {args.baseline} 比较:")
+            compare_with_baseline(results, baseline)
+        else:
+            print(f"基准文件不存在: {args.baseline}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now(reclassify.BEIJING_TZ).isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"生成文件: {args.output}")
+
+def classify_file(input_path, repeat=3):
+    """
+    在临时目录中对input_path重新分类（与reclassify读取reclassify.txt时的路径相同）
+    返回 (最短耗时, 频道行数, result.txt正文sha1, 分类 -> 频道行列表, result.txt内容)
+    """
+    with open(input_path, 'r', encoding='utf-8') as f:
+        count = sum(1 for line in f if line.strip())
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copyfile(input_path, os.path.join(directory, 'reclassify.txt'))
+        os.chdir(directory)
+        try:
+            seconds, success = measure(reclassify.reclassify_reclassify_txt, repeat)
+            if not success:
+                raise RuntimeError(f"重分类 {input_path} 失败")
+            digest, sections = reclassify.read_result_sections('result.txt')
+            with open('result.txt', 'rb') as f:
+                output = f.read()
+        finally:
+            os.chdir(cwd)
+    return seconds, count, digest, sections, output
+
+def diff_categories(expected, actual, limit=CHECK_DIFF_EXAMPLES):
+    """比较两份result.txt的分类结果，返回描述差异的文本行"""
+    expected_index = {line: category for category, lines in expected.items() for line in lines}
+    actual_index = {line: category for category, lines in actual.items() for line in lines}
+
+    def category_name(category):
+        return category.split(',')[0]
+
+    moved = [f"{line}: {category_name(category)} -> {category_name(actual_index[line])}"
+             for line, category in expected_index.items()
+             if line in actual_index and actual_index[line] != category]
+    # 同一频道行可能出现多次（重复的播放地址），缺少和多出按出现次数计算
+    expected_counts = Counter(line for lines in expected.values() for line in lines)
+    actual_counts = Counter(line for lines in actual.values() for line in lines)
+    missing = [f"{line} ({category_name(expected_index[line])})"
+               for line in (expected_counts - actual_counts).elements()]
+    extra = [f"{line} ({category_name(actual_index[line])})"
+             for line in (actual_counts - expected_counts).elements()]
+
+    messages = []
+    for title, items in (('分类改变', moved), ('缺少', missing), ('多出', extra)):
+        if items:
+            messages.append(f"  {title}的频道: {len(items)} 个")
+            messages.extend(f"    {item}" for item in items[:limit])
+    if not messages:
+        messages.append("  各频道的分类相同，但分类或频道的顺序不同")
+    return messages
+
+def check(args):
+    """
+    回归检查：分类结果与golden文件一致，各阶段吞吐量不低于THROUGHPUT_BUDGETS，
+    且相对基准结果的下降不超过max_regression；指定advisory_budgets时低于下限只提示
+    """
+    failures = []
+
+    seconds, count, digest, sections, output = classify_file(args.input, args.repeat)
+    if args.update:
+        with open(args.golden, 'wb') as f:
+            f.write(output)
+        print(f"已用当前分类结果更新golden文件: {args.golden}")
+        return
+
+    golden_digest, golden_sections = reclassify.read_result_sections(args.golden)
+    if golden_digest is None:
+        failures.append(f"golden文件不存在: {args.golden}")
+    elif golden_digest != digest:
+        failures.append(f"分类结果与 {args.golden} 不一致")
+        print(f"分类结果与 {args.golden} 不一致:")
+        for message in diff_categories(golden_sections, sections):
+            print(message)
+    else:
+        print(f"分类结果与 {args.golden} 一致（{count} 个频道）")
+
+    results = bench_cpu_stages(args.size, args.repeat, args.seed)
+    results['reclassify_txt'] = stage_result(count, seconds, 'lines')
+
+    budgets = dict(THROUGHPUT_BUDGETS)
+    if args.budgets:
+        with open(args.budgets, 'r', encoding='utf-8') as f:
+            budgets.update(json.load(f))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {}).get(str(args.size), {})
+    else:
+        print("未指定 --baseline，吞吐量只与下限比较")
+
+    print(f"吞吐量（合成数据 {args.size} 个频道，reclassify_txt 为golden输入）:")
+    for stage, result in results.items():
+        rate = result['lines_per_sec']
+        if rate is None:
+            continue
+        notes = []
+        previous = baseline.get(stage, {}).get('lines_per_sec')
+        if previous:
+            floor = previous * (1 - args.max_regression)
+            notes.append(f"基准 {previous:.1f}（{rate / previous:.2f}x）")
+            if rate < floor:
+                failures.append(f"{stage} 吞吐量 {rate:.1f} 行/秒比基准下降超过 {args.max_regression:.0%}")
+                notes.append("未通过")
+        budget = budgets.get(stage)
+        if budget and rate < budget:
+            if args.advisory_budgets:
+                notes.append(f"低于下限 {budget}（仅提示）")
+            else:
+                failures.append(f"{stage} 吞吐量 {rate:.1f} 行/秒低于下限 {budget}")
+                notes.append(f"低于下限 {budget}，未通过")
+        print(f"  {stage:<24} {rate:>12.1f} lines_per_sec  {'  '.join(notes)}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now(reclassify.BEIJING_TZ).isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'results': {str(args.size): results},
+            }, f, ensure_ascii=False, indent=2)
+        print(f"生成文件: {args.output}（可作为之后检查的 --baseline）")
+
+    if failures:
+        print("回归检查未通过:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("回归检查通过")
+
+def generate(args):
+    for size in args.sizes:
+        path = os.path.join(args.directory, f"zubo_all_{size}.txt")
+        count = write_playlist(path, size, seed=args.seed)
+        print(f"生成文件: {path} ({count} 行)")
+
+def serve(args):
+    relay = FakeRelayServer(args.hosts, args.dead_ratio, args.latency, args.jitter, args.dead_mode,
+                            seed=args.seed)
+    hosts = relay.start()
+    if args.playlist:
+        count = write_playlist(args.playlist, args.channels, hosts, seed=args.seed)
+        print(f"生成文件: {args.playlist} ({count} 行)")
+    print(f"模拟转发服务器已启动: {len(hosts)} 个主机，其中失效 {len(relay.dead_hosts)} 个")
+    for host in hosts:
+        print(f"  {host}{' (失效)' if host in relay.dead_hosts else ''}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        relay.stop()
+
+def add_relay_arguments(parser):
+    parser.add_argument('--hosts', type=int, default=FAKE_RELAY_HOSTS, help="模拟的转发服务器数量")
+    parser.add_argument('--dead-ratio', type=float, default=FAKE_RELAY_DEAD_RATIO, help="失效主机比例")
+    parser.add_argument('--latency', type=float, default=FAKE_RELAY_LATENCY, help="返回首字节前的延迟（秒）")
+    parser.add_argument('--jitter', type=float, default=FAKE_RELAY_JITTER, help="延迟的随机抖动（秒）")
+    parser.add_argument('--dead-mode', choices=('reset', 'hang'), default='reset',
+                        help="失效主机的行为：reset立即断开，hang不返回数据直到探测超时")
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="reclassify.py 离线性能基准")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子，相同种子生成相同的数据")
+    parser.add_argument('--log-level', choices=reclassify.LOG_LEVELS, default='quiet', help="reclassify的日志级别")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="逐阶段测量吞吐量")
+    run_parser.add_argument('--sizes', type=int, nargs='*', default=list(DEFAULT_SIZES),
+                            help="解析/标准化/分类阶段使用的频道数")
+    run_parser.add_argument('--probe-sizes', type=int, nargs='*', default=list(DEFAULT_PROBE_SIZES),
+                            help="有效性检测阶段使用的频道数（为空时跳过）")
+    run_parser.add_argument('--probe-mode', choices=('channel', 'group'), default='channel',
+                            help="channel逐频道探测，group按分组抽样探测（与默认运行方式相同）")
+    run_parser.add_argument('--concurrency', type=int, default=reclassify.MAX_CONCURRENT_PROBES, help="总并发数")
+    run_parser.add_argument('--per-host', type=int, default=reclassify.MAX_PROBES_PER_HOST, help="单主机并发数")
+    run_parser.add_argument('--repeat', type=int, default=3, help="CPU阶段重复次数，取最短耗时")
+    run_parser.add_argument('--output', default=BENCHMARK_RESULT_FILE, help="结果文件（为空时不写入）")
+    run_parser.add_argument('--baseline', help="与之前保存的结果文件比较")
+    add_relay_arguments(run_parser)
+
+    check_parser = commands.add_parser('check', help="回归检查：分类结果与golden文件一致、吞吐量不低于预算")
+    check_parser.add_argument('--input', default=GOLDEN_INPUT_FILE, help="重新分类的输入文件")
+    check_parser.add_argument('--golden', default=GOLDEN_RESULT_FILE, help="期望的分类结果（忽略文件头）")
+    check_parser.add_argument('--update', action='store_true',
+                              help="用当前分类结果覆盖golden文件（确认分类规则的改动符合预期后使用）")
+    check_parser.add_argument('--size', type=int, default=CHECK_SIZE, help="测量各阶段吞吐量使用的合成频道数")
+    check_parser.add_argument('--repeat', type=int, default=3, help="每个阶段重复次数，取最短耗时")
+    check_parser.add_argument('--budgets', help="覆盖吞吐量下限的JSON文件（阶段名 -> 行/秒）")
+    check_parser.add_argument('--advisory-budgets', action='store_true',
+                              help="吞吐量低于下限时只提示，不算检查失败（用于较慢的机器）")
+    check_parser.add_argument('--baseline',
+                              help="同一台机器上之前保存的结果（run或check --output），吞吐量不得低于其(1-最大下降比例)")
+    check_parser.add_argument('--output', help="保存本次吞吐量结果，作为之后检查的基准")
+    check_parser.add_argument('--max-regression', type=float, default=MAX_REGRESSION,
+                              help="与基准结果比较时允许的最大吞吐量下降比例")
+
+    generate_parser = commands.add_parser('generate', help="生成合成直播源文件")
+    generate_parser.add_argument('--sizes', type=int, nargs='*', default=list(DEFAULT_SIZES), help="频道数")
+    generate_parser.add_argument('--directory', default='.', help="输出目录")
+
+    serve_parser = commands.add_parser('serve', help="启动模拟转发服务器")
+    serve_parser.add_argument('--playlist', help="同时生成指向模拟服务器的直播源文件")
+    serve_parser.add_argument('--channels', type=int, default=1000, help="直播源的频道数")
+    add_relay_arguments(serve_parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    reclassify.configure_logging(args.log_level)
+    {'run': run, 'check': check, 'generate': generate, 'serve': serve}[args.command](args)
@@ -1,65 +1,679 @@
 import requests
-import subprocess
+import asyncio
+import argparse
+import atexit
+import concurrent.futures
+import cProfile
+import contextlib
+import gzip
+import hashlib
+import http.server
+import io
+import itertools
+import json
+import logging
+import logging.handlers
 import os
+import pickle
+import pstats
+import queue
+import random
 import re
-import concurrent.futures
+import signal
+import sys
+import tempfile
+import threading
 import time
-from collections import defaultdict
+import tracemalloc
+from collections import defaultdict, deque
 from datetime import datetime, timezone, timedelta
+from email.utils import formatdate
+from urllib.parse import urlsplit, urlunsplit
+
+# 上游直播源列表（按顺序合并）
+UPSTREAM_URLS = [
+    "https://raw.githubusercontent.com/q1017673817/iptvz/main/zubo_all.txt",
+]
+# 保存各上游ETag/Last-Modified，用于条件请求；OUTPUT_STATE_KEY下保存上次生成结果时的分类规则和输出设置
+UPSTREAM_STATE_FILE = "upstream_state.json"
+OUTPUT_STATE_KEY = "output"
+DOWNLOAD_TIMEOUT = 30
+
+# 去重时视为默认端口、可以省略的端口
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# 流检测的并发限制
+MAX_CONCURRENT_PROBES = 100
+MAX_PROBES_PER_HOST = 4
+
+# 轻量HTTP探测参数
+TS_PACKET_SIZE = 188
+TS_SYNC_PACKETS = 5
+PROBE_READ_BYTES = 8192
+PROBE_USER_AGENT = "Mozilla/5.0"
+
+# 自适应超时：按该主机（跨运行累计）观察到的连接/首字节延迟分位数推算超时，
+# 取 分位数 × 倍数，并限制在 [最小值, 固定超时] 之间；该主机的样本不足时使用固定超时
+ADAPTIVE_TIMEOUT_PERCENTILE = 0.95
+ADAPTIVE_TIMEOUT_MULTIPLIER = 3
+ADAPTIVE_TIMEOUT_MIN = 1.0
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 5
+# 每个主机最多保留的延迟样本数
+ADAPTIVE_TIMEOUT_HOST_SAMPLES = 50
+
+# 熔断：同一主机连续连接失败或无响应达到该次数后标记为不可用，冷却期内其余探测直接判定无效
+# 连续失败次数跨运行累计，冷却期过后放行的探测再次失败会立即重新熔断
+CIRCUIT_BREAKER_FAILURES = 3
+CIRCUIT_BREAKER_COOLDOWN = 300
+
+# 主机健康状态（延迟样本、连续失败次数、熔断截止时间）跨运行持久化，超过该时间未探测的主机会被丢弃
+HOST_HEALTH_FILE = "host_health.json"
+HOST_HEALTH_MAX_AGE = 7 * 24 * 3600
+
+# 探测结果缓存（跨运行持久化）
+PROBE_CACHE_FILE = "probe_cache.jsonl"
+PROBE_CACHE_POSITIVE_TTL = 12 * 3600
+PROBE_CACHE_NEGATIVE_TTL = 6 * 3600
+# 连续失败时负缓存按2的幂退避，最多放大到该倍数
+PROBE_CACHE_MAX_BACKOFF = 16
+
+# 可选的质量测量（--rank）：首字节时间、持续码率（读取窗口秒数）和ffprobe分辨率，
+# 同一分类中同名频道按速度排序；首字节时间按桶比较，同一档内再按分辨率和码率排序
+QUALITY_READ_SECONDS = 2
+QUALITY_TTFB_BUCKET = 0.05
+QUALITY_FILE = "quality.json"
+
+# 频道数达到该值时使用多进程分类，worker数默认为CPU核数
+PARALLEL_CATEGORIZE_THRESHOLD = 200000
+PARALLEL_CATEGORIZE_CHUNK_SIZE = 10000
+
+# 分类规则文件（分类 -> 频道名称、标准名称 -> 变体）及其编译缓存，与脚本同目录
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+RULES_INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules_index.pickle")
+# 规则文件格式版本和编译缓存格式版本，ChannelNameIndex等结构变化时需要增加后者
+RULES_FORMAT_VERSION = 1
+RULES_INDEX_VERSION = 1
+
+# 服务模式：定时刷新的间隔（秒）和随机抖动比例，以及本地HTTP服务对外提供的文件
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8080
+SERVE_INTERVAL = 3600
+SERVE_JITTER = 0.1
+SERVE_FILES = ("result.txt", "reclassify.txt", "result.m3u8", "result.json")
+SERVE_CONTENT_TYPES = {
+    '.txt': 'text/plain; charset=utf-8',
+    '.m3u8': 'application/vnd.apple.mpegurl; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+}
+
+# 溢出模式（--spill）：分类结果逐行写入每个分类的临时文件，写结果时每次读回的行数
+# 完整运行时检测阶段仍需全部频道记录；写出reclassify.txt后即释放，分类阶段从文件逐行读取，内存占用与频道数无关
+SPILL_CHUNK_LINES = 10000
+
+# 运行指标输出文件（与result.txt同目录）
+METRICS_FILE = "metrics.json"
+
+# 性能剖析模式（--profile）：报告输出目录、热点函数和内存分配位置各列出的条数、调用栈采样间隔（秒）
+PROFILE_DIR = "profile"
+PROFILE_TOP_N = 30
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# 增量模式：保存上次运行的分组清单
+GROUP_MANIFEST_FILE = "group_manifest.json"
+
+# 分组有效性判定：每组最多抽检的频道数，以及判定有效所需的有效频道数
+GROUP_SAMPLE_SIZE = 1
+GROUP_QUORUM = 1
+# 逐个检测每个频道，只保留有效频道
+VALIDATE_EACH_CHANNEL = False
+
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+# 日志级别：quiet只输出警告和错误，summary输出阶段汇总，verbose输出每次探测等逐事件日志
+LOG_LEVELS = {
+    'quiet': logging.WARNING,
+    'summary': logging.INFO,
+    'verbose': logging.DEBUG,
+}
+
+logger = logging.getLogger("reclassify")
+
+class BeijingTimeFormatter(logging.Formatter):
+    """文本日志格式：[北京时间] 消息"""
+
+    def format(self, record):
+        beijing_time = datetime.fromtimestamp(record.created, BEIJING_TZ).strftime("%Y-%m-%d %H:%M:%S")
+        message = f"[{beijing_time}] {record.getMessage()}"
+        if record.exc_text:
+            message += "\n" + record.exc_text
+        return message
+
+class JsonLinesFormatter(logging.Formatter):
+    """JSON-lines日志格式，每条日志一行"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, BEIJING_TZ).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'message': record.getMessage(),
+        }
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class QueueRecordHandler(logging.handlers.QueueHandler):
+    """只在调用线程合并消息参数和格式化异常堆栈，其余格式化留给后台线程"""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+_log_listener = None
+
+def stop_logging():
+    """停止后台日志线程，写出队列中剩余的日志"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+atexit.register(stop_logging)
+
+def configure_logging(level='summary', json_lines=False, stream=None):
+    """
+    配置日志：日志记录只放入队列，由后台线程统一格式化和写出，
+    避免多个探测同时写stdout时互相阻塞
+    """
+    global _log_listener
+    stop_logging()
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonLinesFormatter() if json_lines else BeijingTimeFormatter())
+
+    log_queue = queue.SimpleQueue()
+    logger.handlers[:] = [QueueRecordHandler(log_queue)]
+    logger.setLevel(LOG_LEVELS[level])
+    logger.propagate = False
+
+    _log_listener = logging.handlers.QueueListener(log_queue, handler)
+    _log_listener.start()
+    return _log_listener
 
 def debug_log(message):
-    """调试日志函数"""
-    beijing_time = datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{beijing_time}] {message}")
+    """调试日志函数（summary级别）"""
+    logger.info(message)
+
+def verbose_log(message, *args):
+    """逐事件的详细日志（verbose级别），使用%格式参数，未启用时不做任何格式化"""
+    logger.debug(message, *args)
+
+def warning_log(message, exc_info=False):
+    """警告和错误日志（quiet级别也会输出），exc_info为True时附带当前异常的堆栈"""
+    logger.warning(message, exc_info=exc_info)
+
+class Channel:
+    """
+    频道记录：名称、播放地址、所属地区运营商（分组名）、标准化名称和分类编号
+    地区和名称字符串会被驻留，相同的字符串只保存一份；输出行只在写文件时格式化
+    """
+    __slots__ = ('name', 'url', 'region', 'normalized_name', 'category')
+
+    def __init__(self, name, url, region, normalized_name=None, category=None):
+        self.name = sys.intern(name)
+        self.url = url
+        self.region = sys.intern(region)
+        self.normalized_name = normalized_name
+        self.category = category
+
+    def __repr__(self):
+        return f"Channel({self.name!r}, {self.url!r}, {self.region!r})"
+
+    def __str__(self):
+        return self.to_line()
+
+    def to_line(self):
+        """原始格式：频道名称,地址$地区运营商"""
+        return f"{self.name},{self.url}${self.region}"
+
+    @classmethod
+    def from_result_line(cls, line):
+        """解析to_result_line写出的行，其中的名称即为输出名称"""
+        name, _, rest = line.partition(',')
+        url, _, region = rest.rpartition('$')
+        return cls(name, url, region)
+
+    @property
+    def result_name(self):
+        """重分类结果中的名称：已分类的频道使用标准化名称"""
+        return self.normalized_name if self.category is not None else self.name
+
+    def to_result_line(self):
+        """重分类格式：输出名称,地址$地区运营商"""
+        return f"{self.result_name},{self.url}${self.region}"
+
+class Metrics:
+    """
+    运行指标：各阶段耗时、探测延迟分布、按原因统计的失败次数和各主机成功率
+    写入metrics.json，便于跨运行比较
+    """
+    # 探测延迟直方图的桶上界（秒）
+    LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10)
+
+    def __init__(self, profiler=None):
+        self.stages = {}
+        self.profiler = profiler
+        self.latencies = []
+        self.outcomes = defaultdict(int)
+        self.hosts = defaultdict(lambda: {'probes': 0, 'valid': 0})
+        self.channels = []
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """统计一个阶段的耗时（同名阶段累加）"""
+        started = time.perf_counter()
+        try:
+            with self.profile(name):
+                yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - started)
+
+    def profile(self, name):
+        """剖析模式下对阶段做性能剖析，否则什么也不做"""
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.stage(name)
+
+    def add_stage_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def timed_iter(self, name, iterable):
+        """包装迭代器，把等待下一个元素的时间计入阶段耗时"""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_stage_time(name, time.perf_counter() - started)
+                return
+            self.add_stage_time(name, time.perf_counter() - started)
+            yield item
+
+    def record_probe(self, url, elapsed, reason):
+        """记录一次探测的耗时和结果"""
+        self.latencies.append(elapsed)
+        self.outcomes[reason or 'unknown'] += 1
+        host = self.hosts[get_stream_host(url)]
+        host['probes'] += 1
+        if reason == 'valid':
+            host['valid'] += 1
+
+    def record_channels(self, group_name, channels, results):
+        """逐频道检测模式下记录每个频道的检测结果（检测异常按无效记录）"""
+        for channel, result in zip(channels, results):
+            self.channels.append({'group': group_name, 'name': channel.name, 'url': channel.url,
+                                  'valid': result is True})
 
-def download_file(url):
-    """下载原始文件"""
-    debug_log(f"正在下载文件: {url}")
+    def latency_summary(self):
+        """延迟直方图和分位数"""
+        histogram = {f"<={bound}s": 0 for bound in self.LATENCY_BUCKETS}
+        overflow = f">{self.LATENCY_BUCKETS[-1]}s"
+        histogram[overflow] = 0
+        for latency in self.latencies:
+            for bound in self.LATENCY_BUCKETS:
+                if latency <= bound:
+                    histogram[f"<={bound}s"] += 1
+                    break
+            else:
+                histogram[overflow] += 1
+
+        ordered = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+        return {
+            'count': len(ordered),
+            'histogram': histogram,
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': round(ordered[-1], 4) if ordered else None,
+        }
+
+    def to_dict(self):
+        return {
+            'generated_at': datetime.now(BEIJING_TZ).isoformat(timespec='seconds'),
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            'probe_latency': self.latency_summary(),
+            'probe_outcomes': dict(self.outcomes),
+            'hosts': {
+                host: dict(stats, success_rate=round(stats['valid'] / stats['probes'], 4))
+                for host, stats in sorted(self.hosts.items())
+            },
+            'counters': self.counters,
+            'channels': self.channels,
+        }
+
+    def write(self, path=METRICS_FILE):
+        """写入metrics.json（先写临时文件再原子替换）"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        debug_log(f"生成文件: {path}")
+
+class StageProfiler:
+    """
+    性能剖析（--profile）：按阶段记录cProfile热点函数和tracemalloc内存分配位置，
+    可选地按固定间隔采样所有线程的调用栈，输出火焰图工具可用的折叠栈文件
+    只在剖析模式下创建，普通运行不承担任何剖析开销
+    """
+
+    def __init__(self, output_dir=PROFILE_DIR, collapsed_path=None, top_n=PROFILE_TOP_N,
+                 sample_interval=PROFILE_SAMPLE_INTERVAL):
+        self.output_dir = output_dir
+        self.collapsed_path = collapsed_path
+        self.top_n = top_n
+        self.sample_interval = sample_interval
+        self.reports = []
+        self.stacks = defaultdict(int)
+        self.active = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """剖析一个阶段；阶段嵌套时只剖析最外层"""
+        if self.active is not None:
+            yield
+            return
+
+        self.active = name
+        profiles = [cProfile.Profile()]
+
+        def profile_new_thread(frame, event, arg):
+            # 阶段内新建的线程（如解析线程）各自使用一个cProfile，首个事件之后由它接管
+            thread_profile = cProfile.Profile()
+            try:
+                thread_profile.enable()
+            except ValueError:
+                # Python 3.12起cProfile基于sys.monitoring，主线程的剖析已覆盖所有线程
+                sys.setprofile(None)
+                return
+            profiles.append(thread_profile)
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        sampler = self.start_sampler(name) if self.collapsed_path else None
+        threading.setprofile(profile_new_thread)
+        started = time.perf_counter()
+        profiles[0].enable()
+        try:
+            yield
+        finally:
+            profiles[0].disable()
+            elapsed = time.perf_counter() - started
+            threading.setprofile(None)
+            if sampler is not None:
+                sampler.set()
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            self.active = None
+            self.reports.append(self.build_report(name, elapsed, profiles, before, after, peak))
+
+    def start_sampler(self, name):
+        """后台线程定时采样所有线程的调用栈，返回用于停止采样的Event"""
+        stop = threading.Event()
+
+        def sample():
+            own_id = threading.get_ident()
+            while not stop.wait(self.sample_interval):
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        code = frame.f_code
+                        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    frames.append(name)
+                    self.stacks[';'.join(reversed(frames))] += 1
+
+        threading.Thread(target=sample, name="profile-sampler", daemon=True).start()
+        return stop
+
+    def build_report(self, name, elapsed, profiles, before, after, peak):
+        """生成一个阶段的文本报告：按自身耗时和累计耗时排序的热点函数、新增内存最多的分配位置"""
+        out = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=out)
+        for thread_profile in profiles[1:]:
+            stats.add(thread_profile)
+        stats.dump_stats(os.path.join(self.output_dir, f"{len(self.reports) + 1:02d}-{name}.prof"))
+
+        out.write(f"=== 阶段: {name} ===\n")
+        out.write(f"耗时: {elapsed:.3f} 秒，剖析线程数: {len(profiles)}，内存峰值: {peak / 1024 / 1024:.1f} MB\n\n")
+        for sort_key, title in (('tottime', '热点函数（按自身耗时）'), ('cumulative', '热点函数（按累计耗时）')):
+            out.write(f"--- {title} ---\n")
+            stats.sort_stats(sort_key).print_stats(self.top_n)
+
+        out.write("--- 新增内存最多的分配位置 ---\n")
+        for stat in after.compare_to(before, 'lineno')[:self.top_n]:
+            out.write(f"{stat}\n")
+        out.write("\n")
+        return out.getvalue()
+
+    def write(self):
+        """写出剖析报告和折叠栈文件"""
+        path = os.path.join(self.output_dir, 'report.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(self.reports)
+        debug_log(f"生成性能剖析报告: {path}")
+
+        if self.collapsed_path:
+            with open(self.collapsed_path, 'w', encoding='utf-8') as f:
+                for stack, count in sorted(self.stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            debug_log(f"生成折叠栈文件: {self.collapsed_path}（{sum(self.stacks.values())} 次采样）")
+
+def create_session(pool_size=4):
+    """创建带连接池的HTTP会话，默认接受gzip压缩"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+def load_upstream_state(path=UPSTREAM_STATE_FILE):
+    """读取上次下载时各上游的ETag/Last-Modified"""
+    if not path or not os.path.exists(path):
+        return {}
     try:
-        response = requests.get(url, timeout=30)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        warning_log(f"读取上游状态失败: {e}")
+        return {}
+
+def save_upstream_state(state, path=UPSTREAM_STATE_FILE):
+    """保存各上游的ETag/Last-Modified（先写临时文件再原子替换）"""
+    if not path:
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def open_upstream(session, url, validators=None):
+    """发起（条件）流式请求，只读取响应头；失败时返回None"""
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    try:
+        response = session.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT, stream=True)
         response.raise_for_status()
-        debug_log(f"下载成功，文件大小: {len(response.text)} 字符")
-        return response.text
+        return response
     except Exception as e:
-        debug_log(f"下载失败: {e}")
+        warning_log(f"下载失败: {url}: {e}")
         return None
 
-def process_content(content):
-    """处理内容"""
-    if not content:
-        debug_log("内容为空，无法处理")
-        return []
-        
-    lines = content.split('\n')
-    debug_log(f"原始文件行数: {len(lines)}")
+def fetch_upstreams(session, urls, state):
+    """并发向所有上游发起条件请求，返回 地址 -> 响应（失败为None）"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(urls))) as executor:
+        responses = list(executor.map(lambda url: open_upstream(session, url, state.get(url)), urls))
     
-    # 1. 删除前两行
-    if len(lines) >= 2:
-        lines = lines[2:]
-        debug_log(f"删除前两行后行数: {len(lines)}")
-    else:
-        debug_log("文件行数不足，无法删除前两行")
-        return []
-    
-    # 只返回非空行
-    non_empty_lines = [line for line in lines if line.strip()]
-    debug_log(f"非空行数: {len(non_empty_lines)}")
-    
-    # 打印前几行作为示例
-    if non_empty_lines:
-        debug_log("前5行示例:")
-        for i in range(min(5, len(non_empty_lines))):
-            debug_log(f"  {i+1}: {non_empty_lines[i]}")
+    for url, response in zip(urls, responses):
+        if response is None:
+            continue
+        if response.status_code == 304:
+            debug_log(f"上游未变化 (304): {url}")
+        else:
+            debug_log(f"上游已更新 ({response.status_code}): {url}")
+    return dict(zip(urls, responses))
+
+def response_validators(response):
+    """提取响应中用于条件请求的校验信息"""
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+
+def iter_response_lines(response):
+    """
+    从流式响应中逐行读取，不在内存中保留完整内容
+    连接中断或内容不完整时抛出异常，不能把读到一半的内容当作完整文件处理
+    """
+    debug_log(f"正在流式下载文件: {response.url}")
+    try:
+        with response:
+            # 未声明字符集时按UTF-8解码
+            if 'charset' not in response.headers.get('Content-Type', '').lower():
+                response.encoding = 'utf-8'
+            line_count = 0
+            for line in response.iter_lines(decode_unicode=True):
+                line_count += 1
+                yield line
+        debug_log(f"下载完成，共 {line_count} 行")
+    except Exception as e:
+        warning_log(f"下载中断: {response.url}: {e}")
+        raise
+
+def iter_content_lines(lines):
+    """逐行处理内容：删除前两行，只产出非空行"""
+    total = 0
+    non_empty = 0
+    for line in lines:
+        total += 1
+        # 1. 删除前两行
+        if total <= 2:
+            continue
+        if not line.strip():
+            continue
+        non_empty += 1
+        # 打印前几行作为示例
+        if non_empty <= 5:
+            verbose_log("  %d: %s", non_empty, line)
+        yield line
     
-    return non_empty_lines
+    if total < 2:
+        debug_log("文件行数不足，无法删除前两行")
+    debug_log(f"原始文件行数: {total}，非空行数: {non_empty}")
+
+def canonical_url(url):
+    """
+    播放地址的规范形式，用于去重：协议和主机小写、省略默认端口，
+    udpxy的 /udp/ 与 /rtp/ 转发同一个组播流，统一为 /rtp/
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f"[{host}]"
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        host = f"{host}:{port}"
+    path = parts.path
+    if path.startswith('/udp/'):
+        path = '/rtp/' + path[5:]
+    return urlunsplit((scheme, host, path, parts.query, ''))
+
+class ChannelDeduplicator:
+    """
+    按规范化播放地址去重：字典记录每个地址保留的频道名称，重复的频道记录只保留第一次出现的；
+    同一地址的名称归入不同分类时视为冲突，两条记录都保留并计数，不让已分类的频道被同地址的其他频道挤掉
+    """
 
-def parse_groups(lines):
-    """解析分组"""
-    groups = {}
+    def __init__(self):
+        self.seen = {}
+        self.dropped = 0
+        self.conflicts = 0
+
+    def add(self, url, name=None):
+        """地址第一次出现或名称归入不同分类时返回True，重复时计数并返回False"""
+        key = canonical_url(url)
+        kept_name = self.seen.get(key)
+        if kept_name is None:
+            self.seen[key] = name or ''
+            return True
+        if name is None or name == kept_name:
+            self.dropped += 1
+            return False
+
+        category = CATEGORY_INDEX.get(normalize_channel_name(name))
+        kept_category = CATEGORY_INDEX.get(normalize_channel_name(kept_name))
+        if category is None or category == kept_category:
+            self.dropped += 1
+            return False
+        self.conflicts += 1
+        verbose_log("同一地址对应不同分类的频道，均保留: %s / %s: %s", kept_name, name, url)
+        if kept_category is None:
+            self.seen[key] = name
+        return True
+
+    def log_summary(self):
+        if self.dropped:
+            debug_log(f"去除重复地址的频道: {self.dropped} 个")
+        if self.conflicts:
+            debug_log(f"同一地址对应不同分类的频道: {self.conflicts} 个，已均保留")
+
+def parse_groups(lines, on_group_ready=None, ready_size=1, deduplicator=None):
+    """
+    解析分组
+    on_group_ready(group_name, channels) 会在分组解析出ready_size个频道时调用一次，
+    频道不足ready_size的分组在分组结束时调用；ready_size为None表示分组结束时才调用
+    提供deduplicator时丢弃播放地址与之前频道重复的记录
+    同名分组出现多次时（多个上游中有相同的分组），每次出现作为一段单独通知，结果中合并为一个分组
+    """
+    segments = {}
     current_group = None
+    channels = None
+    current_ready = True
     
     debug_log("开始解析分组...")
     
+    def finish_group():
+        if not current_ready and channels:
+            on_group_ready(current_group, channels)
+    
     for line in lines:
         line = line.strip()
         if not line:
@@ -67,649 +681,2182 @@ def parse_groups(lines):
             
         # 检查是否是分组行
         if line.endswith(',#genre#'):
+            if on_group_ready is not None and current_group is not None:
+                finish_group()
             # 提取组名并删除"-组播"字符串
             group_name = line.split(',')[0]
             # 删除组名中的"-组播"字符串
-            group_name = group_name.replace('-组播', '')
+            group_name = sys.intern(group_name.replace('-组播', ''))
             current_group = group_name
-            groups[current_group] = []
-            debug_log(f"找到分组: {group_name}")
+            current_ready = False
+            channels = []
+            if group_name in segments:
+                verbose_log("分组再次出现，合并频道: %s", group_name)
+                segments[group_name].append(channels)
+            else:
+                segments[group_name] = [channels]
+                verbose_log("找到分组: %s", group_name)
         elif current_group and ',' in line:
             # 频道行：频道名称,播放地址
             parts = line.split(',', 1)
             if len(parts) == 2:
                 channel_name, channel_url = parts
-                groups[current_group].append((channel_name, channel_url))
+                if deduplicator is not None and not deduplicator.add(channel_url, channel_name):
+                    verbose_log("重复地址，跳过: %s", line)
+                    continue
+                channels.append(Channel(channel_name, channel_url, current_group))
+                # 分组已就绪时立即通知，以便尽早开始探测
+                if on_group_ready is not None and not current_ready and ready_size is not None \
+                        and len(channels) >= ready_size:
+                    current_ready = True
+                    on_group_ready(current_group, channels)
+    
+    if on_group_ready is not None and current_group is not None:
+        finish_group()
     
+    groups = {
+        group_name: parts[0] if len(parts) == 1 else [channel for part in parts for channel in part]
+        for group_name, parts in segments.items()
+    }
     debug_log(f"共解析出 {len(groups)} 个分组")
+    if deduplicator is not None:
+        deduplicator.log_summary()
     
     # 打印分组统计
-    for group_name, channels in groups.items():
-        debug_log(f"分组 '{group_name}' 有 {len(channels)} 个频道")
+    if logger.isEnabledFor(logging.DEBUG):
+        for group_name, channels in groups.items():
+            verbose_log("分组 '%s' 有 %d 个频道", group_name, len(channels))
     
     return groups
 
-def check_stream(url, timeout=5):
+def get_stream_host(url):
+    """提取播放地址规范形式中的 主机:端口（省略默认端口），用于按主机限制并发和记录主机健康状态"""
+    try:
+        return urlsplit(canonical_url(url)).netloc
+    except ValueError:
+        return ''
+
+class ProbeCache:
+    """
+    探测结果缓存，以JSON-lines格式保存在磁盘上
+    有效结果和无效结果分别使用不同的TTL，连续失败的地址按退避时间跳过
+    """
+
+    def __init__(self, path=PROBE_CACHE_FILE, positive_ttl=PROBE_CACHE_POSITIVE_TTL,
+                 negative_ttl=PROBE_CACHE_NEGATIVE_TTL, max_backoff=PROBE_CACHE_MAX_BACKOFF):
+        self.path = path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_backoff = max_backoff
+        self.entries = {}
+        self.started_at = time.time()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """从磁盘加载缓存，文件不存在或损坏的行会被忽略"""
+        if not self.path or not os.path.exists(self.path):
+            return self
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self.entries[entry['key']] = entry
+                except (ValueError, KeyError, TypeError):
+                    continue
+        debug_log(f"加载探测缓存: {len(self.entries)} 条")
+        return self
+
+    def begin_run(self):
+        """服务模式下复用同一个缓存时，在每次运行开始时重置本次运行的统计"""
+        self.started_at = time.time()
+        self.hits = 0
+        self.misses = 0
+
+    def ttl(self, entry):
+        """计算条目的有效期"""
+        if entry['valid']:
+            return self.positive_ttl
+        backoff = min(2 ** max(entry.get('failures', 1) - 1, 0), self.max_backoff)
+        return self.negative_ttl * backoff
+
+    def get(self, url, now=None):
+        """查询缓存，命中返回True/False，未命中或已过期返回None"""
+        now = time.time() if now is None else now
+        entry = self.entries.get(canonical_url(url))
+        if entry is not None and now - entry['checked_at'] < self.ttl(entry):
+            self.hits += 1
+            return entry['valid']
+        self.misses += 1
+        return None
+
+    def put(self, url, valid, now=None):
+        """记录探测结果"""
+        key = canonical_url(url)
+        previous = self.entries.get(key)
+        failures = 0
+        if not valid:
+            failures = previous.get('failures', 0) if previous and not previous['valid'] else 0
+            # 同一次运行内重复失败只计一次
+            if not previous or previous['checked_at'] < self.started_at or failures == 0:
+                failures += 1
+        self.entries[key] = {
+            'key': key,
+            'valid': bool(valid),
+            'checked_at': time.time() if now is None else now,
+            'failures': failures,
+        }
+
+    def save(self, now=None):
+        """写回磁盘（先写临时文件再原子替换），丢弃早已过期的条目"""
+        if not self.path:
+            return
+        now = time.time() if now is None else now
+        max_age = max(self.positive_ttl, self.negative_ttl * self.max_backoff) * 2
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                if now - entry['checked_at'] < max_age:
+                    f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, self.path)
+
+class HostHealth:
+    """
+    各主机的健康状况：连接和首字节延迟样本（用于推算自适应超时），以及连续失败次数（用于熔断）
+    状态保存在host_health.json中跨运行累计：默认每个转发服务器每次运行只探测一次，
+    只靠单次运行的样本永远达不到推算超时所需的样本数
+    熔断只影响同一次运行中同一主机的后续探测（逐频道检测、抽检多个频道或不按主机合并探测时）
+    """
+    # 视为主机不可达或无响应的探测结果，其他结果（包括HTTP错误、无数据）说明主机本身可以正常响应
+    HOST_FAILURES = frozenset(('connect_timeout', 'connect_error', 'first_byte_timeout'))
+
+    def __init__(self, path=HOST_HEALTH_FILE, failure_threshold=CIRCUIT_BREAKER_FAILURES,
+                 cooldown=CIRCUIT_BREAKER_COOLDOWN, max_age=HOST_HEALTH_MAX_AGE):
+        self.path = path
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_age = max_age
+        self.samples = {'connect': {}, 'first_byte': {}}
+        self.failures = defaultdict(int)
+        self.down_until = {}
+        self.seen_at = {}
+        self.short_circuited = 0
+
+    def load(self):
+        """从磁盘加载各主机的状态，文件不存在或损坏时从空状态开始"""
+        if not self.path or not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                hosts = json.load(f)['hosts']
+            for host, entry in hosts.items():
+                for kind, host_samples in self.samples.items():
+                    if entry.get(kind):
+                        host_samples[host] = deque(entry[kind], maxlen=ADAPTIVE_TIMEOUT_HOST_SAMPLES)
+                if entry.get('failures'):
+                    self.failures[host] = entry['failures']
+                if entry.get('down_until'):
+                    self.down_until[host] = entry['down_until']
+                self.seen_at[host] = entry['seen_at']
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            warning_log(f"读取主机健康状态失败: {e}")
+        debug_log(f"加载主机健康状态: {len(self.seen_at)} 个主机")
+        return self
+
+    def save(self, now=None):
+        """写回磁盘（先写临时文件再原子替换），丢弃长时间未探测的主机"""
+        if not self.path:
+            return
+        now = time.time() if now is None else now
+        hosts = {}
+        for host, seen_at in self.seen_at.items():
+            if now - seen_at >= self.max_age:
+                continue
+            entry = {'seen_at': seen_at}
+            for kind, host_samples in self.samples.items():
+                if host in host_samples:
+                    entry[kind] = [round(seconds, 4) for seconds in host_samples[host]]
+            if self.failures.get(host):
+                entry['failures'] = self.failures[host]
+            if self.is_down(host, now):
+                entry['down_until'] = self.down_until[host]
+            hosts[host] = entry
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'hosts': hosts}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def record_latency(self, host, kind, seconds):
+        """记录一次连接（connect）或首字节（first_byte）延迟"""
+        host_samples = self.samples[kind].get(host)
+        if host_samples is None:
+            host_samples = self.samples[kind][host] = deque(maxlen=ADAPTIVE_TIMEOUT_HOST_SAMPLES)
+        host_samples.append(seconds)
+
+    def adaptive_timeout(self, samples, timeout):
+        if len(samples) < ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+            return timeout
+        ordered = sorted(samples)
+        observed = ordered[min(len(ordered) - 1, int(ADAPTIVE_TIMEOUT_PERCENTILE * len(ordered)))]
+        return min(timeout, max(ADAPTIVE_TIMEOUT_MIN, observed * ADAPTIVE_TIMEOUT_MULTIPLIER))
+
+    def timeout(self, host, kind, timeout):
+        """
+        主机的自适应超时，只使用该主机自己的样本；没有足够样本的主机使用固定超时，
+        避免用其他主机的延迟给陌生主机设置过短的超时而误判无效（无效结果会被缓存）
+        """
+        host_samples = self.samples[kind].get(host)
+        if host_samples is None:
+            return timeout
+        return self.adaptive_timeout(host_samples, timeout)
+
+    def is_down(self, host, now=None):
+        """主机是否处于熔断状态（冷却期过后放行探测，再次失败会重新熔断）"""
+        down_until = self.down_until.get(host)
+        return down_until is not None and (time.time() if now is None else now) < down_until
+
+    def record_result(self, host, reason):
+        """根据探测结果更新连续失败次数，达到阈值时熔断"""
+        self.seen_at[host] = time.time()
+        if reason not in self.HOST_FAILURES:
+            self.failures.pop(host, None)
+            self.down_until.pop(host, None)
+            return
+        self.failures[host] += 1
+        if self.failures[host] >= self.failure_threshold:
+            if not self.is_down(host):
+                verbose_log("  主机 %s 连续失败 %d 次，熔断 %d 秒", host, self.failures[host], self.cooldown)
+            self.down_until[host] = time.time() + self.cooldown
+
+    def begin_run(self):
+        """服务模式下跨运行保留延迟样本和熔断状态，只重置本次运行的统计"""
+        self.short_circuited = 0
+
+    @property
+    def hosts_down(self):
+        return sum(1 for host in self.down_until if self.is_down(host))
+
+class ProbeScheduler:
+    """
+    有界并发调度器：全局信号量限制同时运行的探测总数，
+    每个主机再单独限制并发，避免把单个转发服务器压垮
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENT_PROBES, per_host_limit=MAX_PROBES_PER_HOST, cache=None,
+                 metrics=None, health=None):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.per_host_limit = per_host_limit
+        self.host_semaphores = {}
+        self.cache = cache
+        self.metrics = metrics
+        self.health = health if health is not None else HostHealth()
+
+    def host_semaphore(self, url):
+        host = get_stream_host(url)
+        semaphore = self.host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_limit)
+            self.host_semaphores[host] = semaphore
+        return semaphore
+
+    async def probe(self, url, timeout=5):
+        """在并发限制内检测一个流，优先使用缓存结果"""
+        if self.cache is not None:
+            cached = self.cache.get(url)
+            if cached is not None:
+                verbose_log("  缓存命中: %s -> %s", url, '有效' if cached else '无效')
+                return cached
+        
+        host = get_stream_host(url)
+        async with self.host_semaphore(url):
+            # 等待期间主机可能已被熔断，此时不再占用并发额度
+            if self.health.is_down(host):
+                verbose_log("  主机已熔断，跳过: %s", url)
+                self.health.short_circuited += 1
+                if self.metrics is not None:
+                    self.metrics.outcomes['host_down'] += 1
+                return False
+            async with self.semaphore:
+                started = time.perf_counter()
+                is_valid, reason = await probe_stream(url, timeout, self.health)
+                if self.metrics is not None:
+                    self.metrics.record_probe(url, time.perf_counter() - started, reason)
+            self.health.record_result(host, reason)
+        
+        if self.cache is not None:
+            self.cache.put(url, is_valid)
+        return is_valid
+
+def has_ts_sync(data, packets=TS_SYNC_PACKETS):
+    """检查数据中是否存在连续的MPEG-TS同步字节（每188字节一个0x47）"""
+    if len(data) < TS_PACKET_SIZE * packets:
+        return False
+    for offset in range(min(TS_PACKET_SIZE, len(data) - TS_PACKET_SIZE * (packets - 1))):
+        if all(data[offset + i * TS_PACKET_SIZE] == 0x47 for i in range(packets)):
+            return True
+    return False
+
+async def probe_http_ts(url, timeout=5, health=None):
+    """
+    轻量HTTP探测：直接建立连接读取开头数据并检查TS同步字节
+    提供health时，连接和首字节超时按该主机的历史延迟自适应缩短，并记录本次延迟
+    返回 (结果, 原因)，结果为 True(有效) / False(无效) / None(无法判断，需要ffprobe)
+    """
+    try:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+    except ValueError:
+        return None, None
+    # 只处理明文HTTP，其他协议交给ffprobe
+    if parts.scheme != 'http' or not host:
+        return None, None
+    
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    
+    host_key = get_stream_host(url)
+    connect_timeout = first_byte_timeout = timeout
+    if health is not None:
+        connect_timeout = health.timeout(host_key, 'connect', timeout)
+        first_byte_timeout = health.timeout(host_key, 'first_byte', timeout)
+    
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=connect_timeout)
+    except asyncio.TimeoutError:
+        verbose_log("    ✗ 连接超时")
+        return False, 'connect_timeout'
+    except OSError as e:
+        verbose_log("    ✗ 连接失败: %s", e)
+        return False, 'connect_error'
+    if health is not None:
+        health.record_latency(host_key, 'connect', time.perf_counter() - started)
+    
+    try:
+        writer.write(
+            f"GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\nUser-Agent: {PROBE_USER_AGENT}\r\n"
+            f"Connection: close\r\n\r\n".encode('utf-8')
+        )
+        await writer.drain()
+        
+        started = time.perf_counter()
+        try:
+            header = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=first_byte_timeout)
+        except asyncio.TimeoutError:
+            # 转发服务器接受连接后迟迟不返回响应头，按主机无响应处理，不再交给ffprobe等待
+            verbose_log("    ✗ 等待响应超时")
+            return False, 'first_byte_timeout'
+        if health is not None:
+            health.record_latency(host_key, 'first_byte', time.perf_counter() - started)
+        status_line = header.split(b"\r\n", 1)[0].split()
+        status = int(status_line[1]) if len(status_line) >= 2 and status_line[1].isdigit() else 0
+        if status >= 400:
+            verbose_log("    ✗ HTTP状态码: %d", status)
+            return False, 'http_error'
+        if status != 200:
+            return None, None
+        
+        data = bytearray()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(data) < PROBE_READ_BYTES:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(reader.read(PROBE_READ_BYTES - len(data)), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            data += chunk
+            if has_ts_sync(data):
+                verbose_log("    ✓ 流有效 (TS同步字节)")
+                return True, 'valid'
+        
+        if not data:
+            verbose_log("    ✗ 未收到数据")
+            return False, 'no_data'
+        # 收到了数据但不是TS（如HLS、FLV等），交给ffprobe判断
+        return None, None
+        
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+        return None, None
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+async def probe_stream(url, timeout=5, health=None):
     """
-    使用ffprobe检查流有效性
+    检查流有效性：先做轻量HTTP探测，无法判断时再使用ffprobe
+    返回 (是否有效, 原因)
     """
-    debug_log(f"  检测流: {url}")
+    verbose_log("  检测流: %s", url)
+    
+    verdict, reason = await probe_http_ts(url, timeout, health)
+    if verdict is not None:
+        return verdict, reason
     
+    return await check_stream_ffprobe(url, timeout)
+
+async def check_stream_ffprobe(url, timeout=5):
+    """
+    使用ffprobe检查流有效性（异步子进程，超时或取消时结束ffprobe进程）
+    返回 (是否有效, 原因)
+    """
     try:
-        result = subprocess.run(
-            ["ffprobe", "-v", "error", "-show_streams", "-i", url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=timeout + 2
+        process = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error", "-show_streams", "-i", url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
         )
+    except Exception as e:
+        verbose_log("    ✗ 检测异常: %s", e)
+        return False, 'error'
+    
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout + 2)
         
         # 如果输出中包含"codec_type"，则认为流有效
-        is_valid = b"codec_type" in result.stdout
+        is_valid = b"codec_type" in stdout
         
         if is_valid:
-            debug_log(f"    ✓ 流有效")
+            verbose_log("    ✓ 流有效")
         else:
-            debug_log(f"    ✗ 流无效")
-            if result.stderr:
-                error_msg = result.stderr.decode('utf-8', errors='ignore')[:100]
-                debug_log(f"    错误信息: {error_msg}")
+            verbose_log("    ✗ 流无效")
+            if stderr and logger.isEnabledFor(logging.DEBUG):
+                error_msg = stderr.decode('utf-8', errors='ignore')[:100]
+                verbose_log("    错误信息: %s", error_msg)
         
-        return is_valid
+        return is_valid, 'valid' if is_valid else 'ffprobe_invalid'
         
-    except subprocess.TimeoutExpired:
-        debug_log(f"    ✗ 检测超时")
-        return False
+    except asyncio.TimeoutError:
+        verbose_log("    ✗ 检测超时")
+        return False, 'timeout'
     except Exception as e:
-        debug_log(f"    ✗ 检测异常: {e}")
+        verbose_log("    ✗ 检测异常: %s", e)
+        return False, 'error'
+    finally:
+        # 超时或任务被取消时，确保ffprobe进程被结束
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+async def probe_until_quorum(urls, scheduler, quorum, timeout=5):
+    """
+    并发探测多个地址，有效数达到quorum或已不可能达到时立即停止，
+    并取消其余探测（同时结束对应的ffprobe进程）
+    """
+    quorum = max(1, min(quorum, len(urls)))
+    pending = {asyncio.ensure_future(scheduler.probe(url, timeout)) for url in urls}
+    valid_count = invalid_count = 0
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    valid_count += 1
+                else:
+                    invalid_count += 1
+            if valid_count >= quorum:
+                return True
+            if invalid_count > len(urls) - quorum:
+                return False
         return False
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
 
-def check_group_validity(group_name, channels, timeout=5):
+async def check_group_validity(group_name, channels, scheduler, timeout=5,
+                               sample_size=GROUP_SAMPLE_SIZE, quorum=GROUP_QUORUM):
     """检查分组有效性"""
     if not channels:
-        debug_log(f"分组 '{group_name}' 没有频道，跳过")
+        verbose_log("分组 '%s' 没有频道，跳过", group_name)
         return False
     
-    # 取第一个频道的播放地址进行检测
-    first_channel_url = channels[0][1]
+    # 取前sample_size个频道的播放地址进行检测
+    sample_urls = [channel.url for channel in channels[:max(1, sample_size)]]
     
-    debug_log(f"检测分组 '{group_name}' 的第一个频道: {first_channel_url}")
+    if len(sample_urls) == 1:
+        verbose_log("检测分组 '%s' 的第一个频道: %s", group_name, sample_urls[0])
+    else:
+        verbose_log("检测分组 '%s' 的前 %d 个频道 (至少 %d 个有效)", group_name, len(sample_urls),
+                    min(quorum, len(sample_urls)))
     
-    is_valid = check_stream(first_channel_url, timeout)
+    is_valid = await probe_until_quorum(sample_urls, scheduler, quorum, timeout)
     
     if is_valid:
-        debug_log(f"✓ 分组 '{group_name}' 有效，保留")
+        verbose_log("✓ 分组 '%s' 有效，保留", group_name)
         return True
     else:
-        debug_log(f"✗ 分组 '{group_name}' 无效，删除")
+        verbose_log("✗ 分组 '%s' 无效，删除", group_name)
         return False
 
-def filter_valid_groups(groups, max_workers=5):
-    """使用多线程过滤有效的分组"""
-    valid_groups = {}
-    
-    debug_log("开始多线程检测流有效性...")
-    
-    # 准备检测任务
-    tasks = []
-    for group_name, channels in groups.items():
-        if channels:  # 只检测有频道的分组
-            tasks.append((group_name, channels))
-    
-    debug_log(f"共有 {len(tasks)} 个分组需要检测")
-    
-    # 使用线程池并行检测
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 提交所有检测任务
-        future_to_group = {
-            executor.submit(check_group_validity, group_name, channels): group_name 
-            for group_name, channels in tasks
-        }
-        
-        # 收集结果
-        for future in concurrent.futures.as_completed(future_to_group):
-            group_name = future_to_group[future]
-            try:
-                is_valid = future.result()
-                if is_valid:
-                    valid_groups[group_name] = groups[group_name]
-            except Exception as e:
-                debug_log(f"检测分组 '{group_name}' 时发生异常: {e}")
-    
-    debug_log(f"有效性检测完成，有效分组: {len(valid_groups)} 个")
-    return valid_groups
+async def check_group_channels(group_name, channels, scheduler, timeout=5):
+    """逐个检测分组内的所有频道，返回有效的频道列表"""
+    results = await asyncio.gather(
+        *(scheduler.probe(channel.url, timeout) for channel in channels),
+        return_exceptions=True
+    )
+    valid_channels = [channel for channel, result in zip(channels, results) if result is True]
+    verbose_log("分组 '%s' 有效频道 %d/%d", group_name, len(valid_channels), len(channels))
+    if scheduler.metrics is not None:
+        scheduler.metrics.record_channels(group_name, channels, results)
+    return valid_channels
 
-def generate_output(valid_groups):
-    """生成输出内容"""
-    output_lines = []
-    
-    debug_log("生成输出内容...")
-    
-    for group_name, channels in valid_groups.items():
-        debug_log(f"处理分组 '{group_name}' 的 {len(channels)} 个频道")
-        for channel_name, channel_url in channels:
-            # 在播放地址后加入$所属组名
-            output_line = f"{channel_name},{channel_url}${group_name}"
-            output_lines.append(output_line)
-    
-    debug_log(f"共生成 {len(output_lines)} 行输出")
-    return '\n'.join(output_lines)
-
-# 完整的分类映射（按照您要求的顺序）
-CATEGORY_MAPPING = {
-"央视频道,#genre#":[
-"CCTV-1综合","CCTV-2财经","CCTV-3综艺","CCTV-4中文国际","CCTV-5体育","CCTV-5+体育赛事","CCTV-6电影","CCTV-7国防军事","CCTV-8电视剧","CCTV-9纪录","CCTV-10科教","CCTV-11戏曲","CCTV-12社会与法","CCTV-13新闻","CCTV-14少儿","CCTV-15音乐","CCTV-16奥林匹克","CCTV-16奥林匹克4K","CCTV-17农业农村","CCTV-4欧洲","CCTV-4美洲","CCTV-4K","CCTV-8K","中央新影-中学生","中央新影-老故事","中央新影-发现之旅","CGTN","CGTN-纪录","CGTN-法语","CGTN-俄语","CGTN-西班牙语","CGTN-阿拉伯语","中国教育1台","中国教育2台","中国教育4台","早期教育"
-],
-"付费频道,#genre#":[
-"CCTV风云剧场","CCTV怀旧剧场","CCTV第一剧场","CCTV风云足球","CCTV央视台球","CCTV高尔夫·网球","CCTV风云音乐","CCTV央视文化精品","CCTV卫生健康","CCTV电视指南","CCTV兵器科技","CCTV女性时尚","CCTV世界地理","CHC家庭影院","CHC动作电影","CHC影迷电影"
-],
-"卫视频道,#genre#":[
-"山东卫视","北京卫视","东方卫视","重庆卫视","江苏卫视","浙江卫视","江西卫视","安徽卫视","湖南卫视","湖北卫视","河南卫视","河北卫视","广东卫视","广西卫视","深圳卫视","大湾区卫视","东南卫视","海南卫视","四川卫视","贵州卫视","云南卫视","天津卫视","辽宁卫视","黑龙江卫视","吉林卫视","内蒙古卫视","宁夏卫视","山西卫视","陕西卫视","甘肃卫视","青海卫视","新疆卫视","西藏卫视","三沙卫视","兵团卫视","延边卫视","安多卫视","康巴卫视","农林卫视","海峡卫视","山东教育卫视","西藏卫视藏语","安多卫视藏语","康巴卫视藏语","内蒙古卫视蒙语",
-"北京卫视4K","广东卫视4K","深圳卫视4K","山东卫视4K","湖南卫视4K","浙江卫视4K","江苏卫视4K","东方卫视4K","四川卫视4K"
-],
-"国际频道,#genre#":[
-"凤凰卫视","凤凰资讯","凤凰香港","凤凰电影","星空卫视","Channel[V]"
-],
-"山东频道,#genre#":[
-"山东齐鲁频道","山东体育频道","山东农科频道","山东新闻频道","山东少儿频道","山东文旅频道","山东综艺频道","山东生活频道","山东居家购物","济南新闻综合","济南教育频道","济南娱乐","济南少儿","济南影视","济南生活","济南都市","济南鲁中","济宁综合频道","宁阳综合频道","潍坊新闻综合","潍坊经济生活","东平综合频道","乳山综合频道","兖州新闻频道","兰陵综合频道","夏津公共频道","夏津综合频道","宁津综合频道","安丘综合频道","烟台影视频道","烟台新闻综合","烟台经济科技","禹城综合频道","禹城综艺频道","聊城民生频道","聊城综合频道","茌平综合频道","荣成综合频道","莘县综合频道","莱西综合频道","定陶TV-1","文登TV-1","邹城综合频道","郓城综合频道","阳信新闻综合","陵城综合频道","青州文化旅游","青州综合频道","齐河新闻频道","巨野新闻频道","平原综合频道","平度新闻综合","平阴综合频道","德州经济生活","德州新闻综合","新泰乡村频道","新泰综合频道","昌乐综合频道","昌邑综合频道","曲阜综合频道","梁山综合频道","武城综艺影视","武城综合频道","沾化综合频道","淄博影视频道","淄博新闻综合","新闻综合","无棣综合频道","日照岚山频道","蒙阴综合频道","单县综合频道","济阳综合频道","滨州综合频道","青岛1","青岛2","青岛3","青岛4","青岛5","青岛6","烟台公共","宁阳2","菏泽2","济宁公共","济宁生活","沂源新闻","淄博生活","淄博都市","东明1","东营公共","东营新闻","冠县综合","寿光蔬菜","惠民综合","日照新闻","日照科教","栖霞综合","桓台综合","滨州公共","滨州新闻","潍坊寿光新闻","牟平新闻","牟平生活","菏泽1","诸城新闻","长清新闻"
-],
-"北京频道,#genre#":[
-"北京IPTV4K超清","北京IPTV淘电影","北京IPTV淘剧场","北京IPTV淘精彩","北京IPTV淘娱乐","北京IPTV淘BABY","北京IPTV萌宠TV","北京IPTV重温经典","北京纪实科教","北京卡酷少儿","北京体育休闲","北京文艺频道","北京影视频道","北京财经频道","北京生活频道","北京新闻频道","北京青年","北京国际频道","朝阳区","通州区","门头沟区","房山区","密云区","延庆区"
-],
-"上海频道,#genre#":[
-"新视觉","上海新闻综合","上海第一财经","上海东方财经","上海东方影视","上海哈哈炫动","上海五星体育","上海劲爆体育","上海都市频道","上海教育教育","上海纪实人文","上海都市剧场","上海都市剧场4K","上海欢笑剧场","上海欢笑剧场4K","上海动漫秀场","上海动漫秀场4K","上海乐游频道","上海法治天地","上海金色学堂","上海游戏风云","上海生活时尚"
-],
-"广东频道,#genre#":[
-"广东体育频道","广东珠江频道","广东新闻频道","广东民生频道","广东经济科教","广东影视频道","广东少儿频道","广东嘉佳卡通","广东综艺4K","广东4K超高清","广东岭南戏曲","广州综合频道","广州新闻频道","广州影视频道","广州法治频道","南国都市4K","深圳都市频道","深圳电视剧频道","深圳财经生活","深圳体育健康","深圳少儿频道","宝安频道","深圳龙岗频道","佛山公共频道","佛山南海频道","佛山顺德频道","佛山影视频道","佛山综合频道","东莞新闻综合","东莞生活资讯","韶关新闻综合","湛江新闻综合","湛江公共频道","揭阳综合频道","揭阳生活频道","汕尾新闻综合","汕尾文化生活","江门综合频道","江门侨乡生活","潮州综合频道","潮州民生频道","惠州综合频道","惠州公共频道","珠海-1","肇庆综合频道","肇庆生活服务","河源综合频道","河源公共频道","清远新闻综合","清远文旅生活","云浮综合频道","云浮文旅频道","茂名综合频道","茂名文化生活","汕头综合频道","汕头经济生活","中山综合频道","香山文化频道","广东现代教育","广东南方购物","河源生活频道"
-],
-"内蒙古频道,#genre#":[
-"内蒙古蒙语频道","内蒙古经济生活","内蒙古新闻综合","内蒙古文体娱乐","内蒙古农牧频道","内蒙古少儿频道","呼市新闻综合","呼市新闻综合","包头经济频道","包头生活服务","包头新闻综合","乌海新闻综合","乌海都市生活","赤峰新闻综合","赤峰经济服务","赤峰影视娱乐","通辽城市服务","通辽新闻综合","通辽蒙语频道","呼伦贝尔新闻综合","呼伦贝尔文化旅游","呼伦贝尔生活资讯","巴彦淖尔新闻综合","巴彦淖尔经济生活","巴彦淖尔影视娱乐","鄂尔多斯新闻综合","鄂尔多斯经济服务","鄂尔多斯蒙语频道","锡林郭勒1","锡林郭勒2","杭后电视台","达茂电视台","库伦电视台","丰镇电视台","突泉电视台","阿尔山电视台","托克托电视台","额济纳新闻综合","西乌电视台","准格尔综合频道","伊金霍洛旗综合","苏尼特左旗","苏尼特右旗","乌拉特前旗","乌拉特中旗","乌拉特后旗","乌盟经济生活","乌盟新闻综合","兴安新闻综合","兴安文化旅游","兴安影视娱乐","阿拉善新闻综合","XHTV","ELTV","五原","磴口","武川","扎兰屯","阿巴嘎","翁牛特","满洲里","阿右旗","正蓝旗","东乌旗","土左旗","太仆寺旗","科右中旗","正镶白旗","扎赉特旗","察右中旗","喀喇沁县","额尔古纳","和林格尔","克什克腾旗","内蒙古购物"
-],
-"云南频道,#genre#":[
-"云南都市频道","云南娱乐频道","云南影视频道","云南康旅频道","云南少儿频道","澜湄国际频道","云南4K频道","楚雄新闻频道","禄丰市电视台"
-],
-"吉林频道,#genre#":[
-"长影频道","吉林教育","吉林篮球","扶余电视台","延边TV1","延边TV2","TTV洮南1","农安综合","吉林科教","辽源新闻综合","辽源民生社会","松原综合频道","松原生活频道","白山新闻综合1","白山旅游生活2","四平1","四平2","TTV1","TTV2","TTV3","磐石综合频道","图门电视台","双辽","梅河口电视台","DFTV综合","乾安综合"
-],
-"四川频道,#genre#":[
-"四川经济频道","四川文化旅游","四川新闻频道","四川影视文艺","四川星空购物","四川妇女儿童","四川科教频道","四川乡村频道","四川峨眉电影","成都综合频道","成都经济频道","成都生活频道","成都影视频道","成都公共频道","成都少儿频道","蓉城先锋"
-],
-"天津频道,#genre#":[
-"天津新闻频道","天津文艺频道","天津影视频道","天津都市频道","天津体育频道","天津教育频道","天津少儿频道","天津文旅频道","天津购物频道","蓟州电视台","滨海1","滨海2","静海电视台","河东频道","河西频道","保定电视台","大港油田企业"
-],
-"宁夏频道,#genre#":[
-"宁夏公共频道","宁夏教育频道","宁夏经济频道","宁夏少儿频道","宁夏文旅频道","银川公共频道","银川生活频道","银川文体频道"
-],
-"安徽频道,#genre#":[
-"安徽经济生活","安徽影视频道","安徽农业科教","安徽国际频道","安徽公共频道","安徽综艺体育","合肥新闻频道","肥西新闻综合","黄山新闻综合","黄山文旅频道","旌德新闻综合","霍邱新闻综合","六安综合频道","六安社会生活","淮北新闻综合","淮北经济生活","淮南新闻综合","淮南民生频道","滁州新闻综合","滁州科教频道","滁州公共频道","蒙城新闻频道","南陵新闻综合","祁门综合频道","湾沚综合频道","繁昌新闻综合","桐城综合频道","太湖新闻综合","池州新闻综合","池州文教生活","义安新闻综合","阜阳新闻综合","阜阳生活频道","阜阳教育频道","阜阳都市文艺","泗县新闻频道","临泉新闻频道","阜南新闻综合","亳州综合频道","亳州农村频道","徽州新闻频道","蚌埠新闻综合","蚌埠生活频道","寿县新闻综合","屯溪融媒频道","芜湖新闻综合","芜湖生活频道","无为新闻频道","马鞍山新闻综合","马鞍山科教生活","安庆新闻综合","安庆经济生活","潜山综合频道","黄山区融媒","歙县综合频道","休宁新闻综合","黟县新闻综合","宣城综合频道","宣城文旅生活","广德新闻综合","广德生活频道","郎溪新闻频道","宁国新闻综合","铜陵新闻综合","铜陵教育科技","枞阳电视台","霍山综合频道","金寨综合频道","濉溪新闻频道","宿州新闻综合","宿州公共频道","宿州科教频道","萧县新闻综合","五河新闻综合","固镇新闻综合","界首综合频道","利辛新闻综合","涡阳新闻综合"
-],
-"山西频道,#genre#":[
-"黄河电视台","山西经济与科技","山西影视","山西社会与法治","山西文体生活","晋中综合频道","晋中公共频道","运城1台","运城2台","盐湖频道","清徐","朔州-1","朔州-2","孝义电视台","古交电视台","阳曲","太原1","太原2","太原3","太原4","太原5","太原教育","晋能控股","大同教育","阳泉-1新闻综合","阳泉-2科教"
-],
-"广西频道,#genre#":[
-"广西综艺旅游","广西影视频道","广西新闻频道","广西都市频道","广西国际频道","广西移动电视","南宁新闻综合","南宁影视娱乐","南宁公共频道","南宁文旅生活","柳州新闻","北海新闻","玉林新闻","贺州新闻","桂林新闻"
-],
-"新疆频道,#genre#":[
-"XJTV-1","XJTV-2","XJTV-3","XJTV-4","XJTV-5","XJTV-6","XJTV-7","XJTV-8","包头TV1","包头TV2","包头TV3","乌鲁木齐1","阿克苏1","阿克苏2","阿拉尔","阿勒泰1","克孜勒苏柯尔克孜1","克孜勒苏柯尔克孜2","克孜勒苏柯尔克孜3","伊犁哈萨克1","伊犁哈萨克2","伊犁哈萨克3","伊犁哈萨克4","喀什1","喀什2","喀什3","巴音郭楞1","巴音郭楞2","巴音郭楞3","巴音郭楞4","昌吉市电视台","霍城1","呼图壁1","玛纳斯1","竹山1","竹山2","奎屯1","奎屯3","哈密TV1","哈密TV3"
-],
-"江苏频道,#genre#":[
-"江苏城市频道","江苏综艺频道","江苏体育休闲","江苏影视频道","江苏优漫卡通","江苏新闻频道","江苏教育频道","江苏国际频道","江苏财富天下","南京新闻综合","南京科教频道","南京生活频道"
-],
-"江西频道,#genre#":[
-"江西都市频道","江西经济生活","江西影视旅游","江西公共农业","江西少儿频道","江西新闻频道","江西教育频道"
-],
-"河北频道,#genre#":[
-"河北经济生活","河北都市频道","河北影视剧频道","河北少儿科教","河北文旅公共","河北农民","睛彩河北","河北杂技频道","河北三佳购物","石家庄新闻综合","石家庄文化娱乐","石家庄城市服务","承德新闻综合","承德旅游文化","秦皇岛新闻综合","秦皇岛公共频道","秦皇岛影视","唐山新闻综合","唐山生活服务","唐山影视频道","唐山公共频道","廊坊新闻综合","廊坊生活频道","保定新闻综合","保定公共频道","保定生活健康","衡水新闻综合","衡水经济科教","邢台综合频道","邢台城市生活","邯郸新闻综合","邯郸公共频道","邯郸科技教育","高邑融媒","井陉矿区电视台","深泽综合频道","赵县综合频道","晋州综合频道","井陉综合频道","平泉综合频道","兴隆综合频道","隆化综合频道","崇礼电视台","康保综合频道","遵化综合频道","三河综合频道","永清综合频道","成安综合频道","魏县综合新闻","滦南综合频道","玉田综合频道","吴桥综合频道","阜平电视台","涞水综合频道","黄骅电视台","定州新闻综合","雄县电视台","涞源综合频道","高碑店综合频道","涿州综合频道","唐县综合频道","曲阳综合频道","柏乡综合频道","徐水电视台","景县综合频道","饶阳电视台","深州新闻综合","涉县综合频道","鸡泽新闻综合","武安新闻综合","枣强综合频道","清河电视台","大厂融媒体中心","顺平电视","赤城电视","邯山电视","任县电视","双滦电视","滦平电视","赞皇电视","栾城电视","张家口新闻综合","张家口公共","沧州新闻综合","沧州公共频道","沧州影视娱乐","昌黎电视","抚宁电视","卢龙电视","丰南电视","迁西电视","滦州电视","香河电视","大城电视","固安电视","霸州电视","孟村电视","东光电视","青县电视","盐山电视","南皮电视","肃宁电视","丰宁电视","定兴电视","满城电视","望都电视","高阳电视","安新电视","容城电视","涿鹿电视","大名电视","冀州电视","安平电视","阜城电视","故城电视","广宗电视","宁晋电视","平乡电视","隆尧电视","广平电视","南和电视","临漳电视台","内丘电视台","迁安电视","馆陶电视","乐亭电视","沙河电视","南宫电视","丰润电视"
-],
-"河南频道,#genre#":[
-"河南都市频道","河南民生频道","河南法治频道","河南电视剧频道","河南新闻频道","河南乡村频道","河南戏曲频道","河南收藏天下","河南中华功夫","河南移动电视","河南欢腾购物","河南调解剧场","河南移动戏曲","河南睛彩中原","河南IPTV导视","郑州1新闻综合","郑州2商都频道","郑州3文体旅游","郑州4豫剧频道","郑州5妇女儿童","郑州6都市生活","洛阳-1新闻综合","洛阳-2科教频道","洛阳-3文旅频道","南阳1新闻综合","南阳2公共频道","南阳3科教频道","周口公共频道","周口教育频道","周口新闻综合","开封1新闻综合","开封2文化旅游","新乡公共频道","新乡新闻综合","焦作公共频道","焦作综合频道","漯河新闻综合","信阳新闻综合","信阳文旅频道","封丘1新闻综合","叶县电视台-1","新密综合频道","登封综合频道","巩义综合频道","新郑TV-1","渑池新闻综合","淅川电视台-1","新蔡TV","镇平新闻综合","宝丰TV-1","义马综合频道","鹤壁新闻综合","安阳新闻综合","三门峡新闻综合","卫辉综合频道","孟津综合综合","安阳文旅频道","淇县电视台","宜阳综合频道","汝阳综合频道","原阳电视台","宝丰-1","内黄综合频道","郏县综合频道","禹州电视台","杞县新闻综合","永城新闻联播","光山综合频道","商丘1新闻综合","商丘2公共频道","商丘3文体科教","许昌农业科教","许昌综合频道","平顶山新闻综合","平顶山城市频道","平顶山公共频道","平顶山教育台","新乡综合频道","邓州综合频道","获嘉综合频道","平煤安全环保","荥阳综合频道","健康河南融媒","灵宝综合频道","渑池新闻综合","济源-1","濮阳新闻综合","濮阳公共频道","新县综合频道","延津电视台","大象新闻","大剧院","舞钢电视台-1","嵩县综合新闻","浉河广电中心","平桥广电中心","郸城","唐河TV-1","上蔡-1","舞阳新闻综合","临颍综合频道","项城电视台"
-],
-"浙江频道,#genre#":[
-"浙江钱江频道","浙江经济生活","浙江教育频道","浙江民生休闲","浙江新闻频道","浙江少儿频道","浙江之江纪录","杭州综合","杭州明珠","杭州生活","杭州影视","杭州青少","杭州导视","宁波新闻综合","宁波生活频道","宁波文体频道","宁波影视频道","温州新闻综合","绍兴新闻综合","衢州新闻综合","衢州公共频道","温州新闻综合","绍兴新闻综合","湖州新闻","金华新闻","丽水新闻","嘉兴新闻","桐乡新闻","中国蓝直播"
-],
-"海南频道,#genre#":[
-"海南公共频道","海南少儿频道","海南文旅频道","海南新闻频道","海南自贸频道","海口1台","海口2台","海口3台","白沙TV","保亭TV","澄迈TV","儋州TV","定安TV","东方TV","临高","陵水TV","琼海TV","琼中TV","三亚1台","乐东TV","屯昌TV","昌江TV","万宁综合","文昌TV","五指山TV"
-],
-"湖北频道,#genre#":[
-"湖北公共新闻","湖北经视频道","湖北综合频道","湖北垄上频道","湖北影视频道","湖北生活频道","湖北教育频道","武汉新闻综合","武汉电视剧","武汉科技生活","武汉文体频道","武汉教育频道","阳新综合","房县综合","蔡甸综合"
-],
-"湖南频道,#genre#":[
-"湖南卫视FHD","金鹰卡通FHD","金鹰纪实FHD","快乐垂钓FHD","湖南经视FHD","湖南都市FHD","湖南国际FHD","湖南公共FHD","湖南娱乐FHD","湖南电影FHD","湖南电视剧FHD","湖南经视频道","湖南都市频道","湖南国际频道","湖南公共频道","湖南娱乐频道","湖南电影频道","湖南电视剧频道","长沙新闻综合","长沙政法频道","长沙文旅频道","益阳新闻综合","益阳公共频道","岳阳新闻综合","岳阳文旅都市","张家界1新闻综合","张家界2公共频道","湘西新闻综合","湘西文化旅游","株洲新闻综合","永州新闻综合","永州经济生活","湘潭新闻综合","湘潭县电视台","衡阳新闻综合","衡阳文旅法治","衡阳县电视台","邵阳新闻综合","邵阳文旅民生","郴州综合频道","郴州公共频道","怀化新闻综合","常德新闻综合","常德公共频道","娄底综合频道","娄底公共频道","娄底教育频道","东安新闻综合","桃源综合频道","双牌新闻综合","麻阳综合频道","宁远综合频道","汨罗综合频道","新化电视台","津市电视台","武冈综合频道","江永新闻频道","洪江新闻频道","涟源综合频道","溆浦综合频道","蓝山综合频道","新田综合频道","道县综合频道","中方台","桂东融媒"
-],
-"甘肃频道,#genre#":[
-"甘肃文化影视","甘肃公共频道","甘肃科教频道","甘肃经济频道","甘肃少儿频道","陇尚生活","临夏新闻综合","临夏文旅频道","皋兰电视台"
-],
-"福建频道,#genre#":[
-"福建综合频道,","福建公共频道","福建新闻频道","福建电视剧频道","福建经济频道","福建文体频道","福建少儿频道","福建教育频道","福建旅游频道","厦门一套","平潭卫视","龙岩综合频道","福州新闻","泉州一套","莆田新闻"
-],
-"贵州频道,#genre#":[
-"贵州公共频道","贵州影视文艺","贵州大众生活","贵州法制频道","贵州科教健康","贵州经济频道","贵州移动电视","贵阳-1","贵阳-2","贵阳-3","六盘水-1","六盘水-2","黔南-1","黔南-2","黔西南综合频道","黔西南公共频道","黔西-1","黔东南综合频道","遵义综合频道","遵义公共频道","遵义都市频道","铜仁-1","铜仁-2","毕节-1","毕节-2","安顺新闻综合","安顺公共频道","瓮安电视台","思南综合频道","凯里TV","雷山综合频道","贵州直播频道"
-],
-"辽宁频道,#genre#":[
-"辽宁都市频道","辽宁影视剧频道","辽宁体育休闲","辽宁生活频道","辽宁教育青少","辽宁北方频道","辽宁公共频道","辽宁经济频道","沈阳新闻综合","辽河新闻综合","辽河文化生活"
-],
-"重庆频道,#genre#":[
-"重庆新闻频道","重庆影视剧频道","重庆社会与法","重庆红岩文化","重庆文体娱乐","重庆新农村","重庆融媒","重庆少儿频道","重庆红叶频道","重庆汽摩频道","重庆移动频道","开州综合"
-],
-"陕西频道,#genre#":[
-"陕西新闻资讯","陕西都市青春","陕西体育休闲","陕西西部电影","陕西秦腔频道","陕西银铃频道","西安新闻综合","西安都市频道","西安商务资讯","西安戏剧影视","西安丝路频道","西安教育频道","西安乐购购物"
-],
-"青海频道,#genre#":[
-"青海都市","青海经视","西宁新闻综合","西宁生活服务","海东综合频道","海北电视台","海西电视台","久治","青海油田","矿区生活"
-],
-"黑龙江频道,#genre#":[
-"黑龙江影视频道","黑龙江新闻法治","黑龙江少儿频道","黑龙江文体频道","黑龙江农业科教","黑龙江都市频道","哈尔滨新闻综合","哈尔滨生活频道","哈尔滨影视频道","齐齐哈尔新闻综合","齐齐哈尔经济法治","佳木斯新闻综合"
-]
-}
+def group_hash(channels):
+    """计算分组频道集合的哈希，用于判断分组内容是否变化"""
+    digest = hashlib.sha1()
+    for channel in channels:
+        digest.update(f"{channel.name},{channel.url}\n".encode('utf-8'))
+    return digest.hexdigest()
 
-# 简化的频道名称映射
-CHANNEL_NAME_MAPPING = {
-"CCTV-1综合": ["CCTV-1综合"],
-"CCTV-2财经": ["CCTV-2财经"],
-"CCTV-3综艺": ["CCTV-3综艺"],
-"CCTV-4中文国际": ["CCTV-4中文国际"],
-"CCTV-5体育": ["CCTV-5体育"],
-"CCTV-5+体育赛事": ["CCTV-5+体育赛事","CCTV5+体育赛事"],
-"CCTV-6电影": ["CCTV-6电影"],
-"CCTV-7国防军事": ["CCTV-7国防军事"],
-"CCTV-8电视剧": ["CCTV-8电视剧"],
-"CCTV-9纪录": ["CCTV-9纪录"],
-"CCTV-10科教": ["CCTV-10科教"],
-"CCTV-11戏曲": ["CCTV-11戏曲"],
-"CCTV-12社会与法": ["CCTV-12社会与法"],
-"CCTV-13新闻": ["CCTV-13新闻"],
-"CCTV-14少儿": ["CCTV-14少儿"],
-"CCTV-15音乐": ["CCTV-15音乐"],
-"CCTV-16奥林匹克": ["CCTV-16奥林匹克"],
-"CCTV-16奥林匹克4K": ["CCTV-16奥林匹克4K"],
-"CCTV-17农业农村": ["CCTV-17农业农村"],
-"CCTV-4欧洲": ["CCTV4欧洲","CCTV-4欧洲","CCTV4欧洲 HD","CCTV-4 欧洲","CCTV-4中文国际欧洲","CCTV-4中文国际 欧洲"],
-"CCTV-4美洲": ["CCTV4美洲","CCTV-4北美","CCTV4美洲 HD","CCTV-4 美洲","CCTV-4中文国际美洲","CCTV-4中文国际 美洲"],
-"CCTV-4K": ["CCTV4K超高清","CCTV4K","CCTV-4K超高清","CCTV 4K","CCTV4K超"],
-"CCTV-8K": ["CCTV8K超高清","CCTV8K","CCTV-8K超高清","CCTV 8K"],
-"CCTV兵器科技": ["CCTV-兵器科技","CCTV兵器科技","兵器科技"],
-"CCTV风云音乐": ["CCTV-风云音乐","CCTV风云音乐","风云音乐"],
-"CCTV第一剧场": ["CCTV-第一剧场","CCTV第一剧场","第一剧场"],
-"CCTV风云足球": ["CCTV-风云足球","CCTV风云足球","风云足球"],
-"CCTV风云剧场": ["CCTV-风云剧场","CCTV风云剧场","风云剧场"],
-"CCTV怀旧剧场": ["CCTV-怀旧剧场","CCTV怀旧剧场","怀旧剧场"],
-"CCTV女性时尚": ["CCTV-女性时尚","CCTV女性时尚","女性时尚"],
-"CCTV世界地理": ["CCTV-世界地理","CCTV世界地理","世界地理"],
-"CCTV央视台球": ["CCTV-央视台球","CCTV央视台球","央视台球"],
-"CCTV高尔夫·网球": ["CCTV-高尔夫网球","CCTV高尔夫网球","CCTV央视高网","CCTV-高尔夫·网球","央视高网","高尔夫网球"],
-"CCTV央视文化精品": ["CCTV-央视文化精品","CCTV央视文化精品","CCTV文化精品","CCTV-文化精品","文化精品","央视文化精品"],
-"CCTV卫生健康": ["CCTV-卫生健康","CCTV卫生健康","卫生健康"],
-"CCTV电视指南": ["CCTV-电视指南","CCTV电视指南","电视指南"],
-"中国教育1台": ["CETV1","中国教育一台","中国教育1","CETV-1 综合教育","CETV-1"],
-"中国教育2台": ["CETV2","中国教育二台","中国教育2","CETV-2 空中课堂","CETV-2"],
-"中国教育3台": ["CETV3","中国教育三台","中国教育3","CETV-3 教育服务","CETV-3"],
-"中国教育4台": ["CETV4","中国教育四台","中国教育4","CETV-4 职业教育","CETV-4"],
-"早期教育": ["中国教育5台","中国教育5","中国教育五台","CETV早期教育","早期教育","CETV 早期教育","CETV-5","CETV5"],
-"CGTN": ["CGTN英语","CGTN-英语"],
-"CGTN-纪录": ["CGTN纪录","CGTN-纪录","CGTN记录","CGTN记录片"],
-"CGTN-西班牙语": ["CGTN-西班牙语","CGTN西班牙语","CGTN西语"],
-"CGTN-法语": ["CGTN-法语","CGTN法语"],
-"CGTN-俄语": ["CGTN-俄语","CGTN俄语"],
-"CGTN-阿拉伯语": ["CGTN-阿拉伯语","CGTN阿拉伯语"],
-"湖南卫视4K": ["湖南卫视4K"],
-"北京卫视4K": ["北京卫视4K","北京卫视4K超高清","北京卫视4K超"],
-"东方卫视4K": ["东方卫视4K"],
-"广东卫视4K": ["广东卫视4K"],
-"深圳卫视4K": ["深圳卫视4K"],
-"山东卫视4K": ["山东卫视4K"],
-"四川卫视4K": ["四川卫视4K"],
-"浙江卫视4K": ["浙江卫视4K"],
-"山东卫视": ["山东卫视"],
-"北京卫视": ["北京卫视"],
-"东方卫视": ["东方卫视"],
-"重庆卫视": ["重庆卫视"],
-"江苏卫视": ["江苏卫视"],
-"浙江卫视": ["浙江卫视"],
-"江西卫视": ["江西卫视"],
-"安徽卫视": ["安徽卫视"],
-"湖南卫视": ["湖南卫视"],
-"湖北卫视": ["湖北卫视"],
-"河南卫视": ["河南卫视"],
-"河北卫视": ["河北卫视"],
-"广东卫视": ["广东卫视"],
-"广西卫视": ["广西卫视"],
-"深圳卫视": ["深圳卫视"],
-"大湾区卫视": ["大湾区卫视"],
-"东南卫视": ["东南卫视"],
-"海南卫视": ["海南卫视"],
-"四川卫视": ["四川卫视"],
-"贵州卫视": ["贵州卫视"],
-"云南卫视": ["云南卫视"],
-"天津卫视": ["天津卫视"],
-"辽宁卫视": ["辽宁卫视"],
-"黑龙江卫视": ["黑龙江卫视"],
-"吉林卫视": ["吉林卫视"],
-"内蒙古卫视": ["内蒙古卫视"],
-"宁夏卫视": ["宁夏卫视"],
-"山西卫视": ["山西卫视"],
-"陕西卫视": ["陕西卫视"],
-"甘肃卫视": ["甘肃卫视"],
-"青海卫视": ["青海卫视"],
-"青海卫视": ["青海卫视"],
-"西藏卫视": ["西藏卫视"],
-"三沙卫视": ["三沙卫视","海南三沙卫视"],
-"兵团卫视": ["兵团卫视","新疆兵团卫视"],
-"延边卫视": ["延边卫视","吉林延边卫视"],
-"海峡卫视": ["海峡卫视","福建海峡卫视"],
-"农林卫视": ["农林卫视","陕西农林卫视"],
-"安多卫视": ["安多卫视","青海安多卫视"],
-"康巴卫视": ["康巴卫视","四川康巴卫视"],
-"西藏卫视藏语": ["西藏卫视（藏语）","西藏卫视藏语","西藏藏语频道"],
-"安多卫视藏语": ["安多藏语综合"],
-"康巴卫视藏语": ["康巴藏语综合"],
-"内蒙古卫视蒙语": ["内蒙古卫视（蒙语）"],
-"山东教育卫视": ["山东教育", "教育卫视"],
-"CHC影迷电影": ["CHC高清电影", "CHC-影迷电影", "影迷电影", "chc高清电影"],
-"CHC动作电影": ["CHC动作电影","CHC-动作电影"],
-"CHC家庭影院": ["CHC家庭影院","CHC-家庭影院"],
-"星空卫视": ["星空卫视", "星空衛视", "星空衛視"],
-"CHANNEL[V]": ["CHANNEL-V", "Channel[V]"],
-"凤凰卫视": ["凤凰卫视中文台", "凤凰中文", "凤凰卫视中文", "凤凰卫视"],
-"凤凰资讯": ["凤凰卫视资讯台", "凤凰资讯", "凤凰卫视资讯"],
-"凤凰香港": ["凤凰香港台", "凤凰卫视香港", "凤凰香港"],
-"凤凰电影": ["凤凰电影", "凤凰电影台", "凤凰卫视电影", "凤凰卫视电影台", " 凤凰电影"],
-"北京IPTV4K超清": ["IPTV淘4K", "北京IPTV4K超清", "北京淘4K", "淘4K", "淘 4K"],
-"北京IPTV淘电影": ["IPTV淘电影", "淘电影", "北京淘电影"],
-"北京IPTV淘精彩": ["IPTV淘精彩", "淘精彩", "北京淘精彩"],
-"北京IPTV淘剧场": ["IPTV淘剧场", "淘剧场", "北京淘剧场"],
-"北京IPTV淘娱乐": ["IPTV淘娱乐", "淘娱乐", "北京淘娱乐"],
-"北京IPTV淘BABY": ["IPTV淘BABY", "淘BABY", "北京淘BABY", "IPTV淘baby", "北京IPTV淘baby", "北京淘baby"],
-"北京IPTV萌宠TV": ["IPTV淘萌宠", "北京IPTV萌宠TV", "北京淘萌宠","淘萌宠"],
-"北京卡酷少儿": ["卡酷少儿", "北京卡酷少儿", "卡酷动画","北京KAKU少儿","BRTV卡酷少儿"],
-"北京纪实科教": ["纪实科教", "北京纪实科教", "BRTV纪实科教", "纪实科教8K"],
-"朝阳区": ["朝阳融媒"],
-"通州区": ["通州融媒"],
-"房山区": ["房山电视台"],
-"密云区": ["密云电视台"],
-"延庆区": ["延庆电视台"],
-"广东岭南戏曲": ["岭南戏曲", "广东岭南戏曲"],
-"广东现代教育": ["现代教育", "广东现代教育"],
-"广东南方购物": ["南方购物", "广东南方购物"],
-"惠州综合频道": ["HZTV-1", "惠州综合频道"],
-"惠州公共频道": ["HZTV-2", "惠州公共频道"],
-"广东嘉佳卡通": ["嘉佳卡通", "广东嘉佳卡通"],
-"江苏优漫卡通": ["优漫卡通", "江苏优漫卡通"],
-"湖南金鹰纪实": ["金鹰纪实", "湖南金鹰纪实"],
-"湖南金鹰卡通": ["金鹰卡通","湖南金鹰卡通"],
-"湖南快乐垂钓": ["快乐垂钓","湖南快乐垂钓"],
-"湖南茶频道": ["茶频道","湖南茶频道"],
-"湖南先锋乒羽": ["先锋乒羽","湖南先锋乒羽"],
-"上海新闻综合": ["新闻综合"],
-"上海都市频道": ["都市频道"],
-"上海东方影视": ["东方影视"],
-"上海教育频道": ["上海教育"],
-"上海第一财经": ["第一财经", "上海第一财经"],
-"上海动漫秀场": ["动漫秀场", "上海动漫秀场"],
-"上海动漫秀场4K": ["动漫秀场4K"],
-"上海都市剧场": ["都市剧场", "上海都市剧场"],
-"上海都市剧场4K": ["都市剧场4K"],
-"上海东方财经": ["东方财经", "上海东方财经"],
-"上海法治天地": ["法治天地", "上海法治天地"],
-"上海游戏风云": ["游戏风云", "上海游戏风云"],
-"上海生活时尚": ["生活时尚", "上海生活时尚"],
-"上海金色学堂": ["金色学堂", "上海金色学堂"],
-"上海乐游频道": ["乐游","乐游频道", "上海乐游","上海乐游纪实"],
-"上海欢笑剧场": ["欢笑剧场", "上海欢笑剧场"],
-"上海欢笑剧场4K": ["欢笑剧场4K", "上海欢笑剧场4K"],
-"上海哈哈炫动": ["哈哈炫动","炫动卡通", "上海哈哈炫动"],
-"河南梨园频道": ["梨园","河南梨园频道"],
-"河南文物宝库": ["文物宝库","河南文物宝库"],
-"河南武术世界": ["武术世界","河南武术世界"],
-"河北农民": ["河北三农频道"],
-"魅力足球": ["魅力足球"],
-"天元围棋": ["天元围棋"],
-"中国天气": ["中国天气"],
-"中国交通": ["中国交通","中国交通频道"],
-"睛彩青少": ["睛彩羽毛球"],
-"睛彩竞技": ["睛彩竞技"],
-"睛彩篮球": ["睛彩篮球"],
-"睛彩广场舞": ["睛彩广场舞"],
-"求索纪录": ["求索记录"],
-"求索纪录4K": ["求索纪录4K", "求索记录4K", "求索纪录 4K", "求索记录 4K"],
-"成都综合频道": ["CDTV1综合"],
-"成都经济频道": ["CDTV2经济"],
-"成都生活频道": ["CDTV3生活"],
-"成都影视频道": ["CDTV4影视"],
-"成都公共频道": ["CDTV5公共"],
-"成都少儿频道": ["CDTV6少儿"],
-"黄河电视台": ["山西黄河频道"],
-"山西影视": ["山西影视频道"],
-"XJTV-1": ["新疆卫视"],
-"XJTV-2": ["新疆卫视2"],
-"XJTV-3": ["新疆卫视3"],
-"XJTV-4": ["新疆卫视4"],
-"XJTV-5": ["新疆卫视5"],
-"XJTV-6": ["新疆卫视6"],
-"XJTV-7": ["新疆卫视10"],
-"XJTV-8": ["新疆卫视12"],
-"海南公共频道": ["海南公共"],
-"海南少儿频道": ["海南少儿"],
-"海南文旅频道": ["海南文旅"],
-"海南新闻频道": ["海南新闻"],
-"海南自贸频道": ["海南自贸"],
-"海口1台": ["海口1"],
-"三亚1台": ["三亚1"],
-"澄迈TV": ["澄迈"],
-"贵州公共频道": ["贵州卫视2"],
-"贵州影视文艺": ["贵州卫视3"],
-"贵州大众生活": ["贵州卫视4"],
-"贵州法制频道": ["贵州卫视5"],
-"贵州科教健康": ["贵州卫视6"],
-"贵州经济频道": ["贵州卫视7"],
-"重庆新闻频道": ["重庆新闻频道"],
-"重庆影视剧频道": ["重庆影视剧频道"],
-"重庆社会与法": ["重庆社会与法"],
-"重庆红岩文化": ["重庆红岩文化","重庆时红岩文化"],
-"重庆文体娱乐": ["重庆文体娱乐"],
-"重庆新农村": ["重庆新农村","重庆新农村频道"],
-"重庆融媒": ["重广融媒"],
-"重庆少儿频道": ["重庆少儿频道"],
-"重庆红叶频道": ["重庆红叶频道"],
-"重庆汽摩频道": ["汽摩","汽摩频道","重庆汽摩","重庆汽摩频道"],
-"重庆移动频道": ["重庆移动频道"],
-"开州综合": ["开州综合"]
-}
+def rules_hash():
+    """计算分类规则的哈希，规则变化时增量模式需要全量重分类"""
+    payload = json.dumps([CATEGORY_MAPPING, CHANNEL_NAME_MAPPING], ensure_ascii=False, sort_keys=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
 
-def normalize_channel_name(channel_name):
-    """标准化频道名称"""
-    channel_name_clean = channel_name.strip()
-    
-    # 先精确匹配
-    for standard_name, variants in CHANNEL_NAME_MAPPING.items():
-        if channel_name_clean in variants:
-            return standard_name
-    
-    # 然后模糊匹配
-    for standard_name, variants in CHANNEL_NAME_MAPPING.items():
-        for variant in variants:
-            if variant.lower() in channel_name_clean.lower() or channel_name_clean.lower() in variant.lower():
-                return standard_name
-                
-    return channel_name_clean
+def output_settings(formats, rank=False, top_k=None, sample_size=GROUP_SAMPLE_SIZE, quorum=GROUP_QUORUM,
+                    per_channel=VALIDATE_EACH_CHANNEL):
+    """
+    影响结果文件内容的设置：分类规则哈希、导出格式、质量排序参数和有效性判定方式，
+    任一变化时即使上游未变化也需要重新生成
+    """
+    return {'rules': rules_hash(), 'formats': sorted(formats), 'rank': bool(rank), 'top_k': top_k,
+            'sample_size': sample_size, 'quorum': quorum, 'per_channel': bool(per_channel)}
 
-def categorize_channels(formatted_channels):
-    """根据分类规则重新分类频道"""
-    if not formatted_channels:
-        debug_log("没有频道需要分类")
-        return {}, []
-        
-    debug_log("开始分类频道...")
-    categorized = defaultdict(list)
-    uncategorized = []
-    
-    for channel_line in formatted_channels:
-        # 解析频道行 - 格式是: 频道名称,地址$地区运营商
-        match = re.match(r'^([^,]+),([^$]+)\$([^$]+)$', channel_line)
-        if not match:
-            debug_log(f"无法解析频道行: {channel_line}")
-            continue
-            
-        channel_name, channel_url, region = match.groups()
-        normalized_name = normalize_channel_name(channel_name)
-        
-        # 查找分类
-        categorized_flag = False
-        for category, channels in CATEGORY_MAPPING.items():
-            if normalized_name in channels:
-                # 存储完整格式：频道名称,地址$地区运营商
-                categorized[category].append(f'{normalized_name},{channel_url}${region}')
-                categorized_flag = True
-                break
-        
-        if not categorized_flag:
-            uncategorized.append(f'{channel_name},{channel_url}${region}')
-    
-    debug_log(f"分类完成: 已分类 {sum(len(channels) for channels in categorized.values())}, 未分类 {len(uncategorized)}")
-    return categorized, uncategorized
+class GroupManifest:
+    """
+    增量模式使用的分组清单：分组 -> 频道集合哈希、有效性和检测时间，
+    以及上次使用的分类规则哈希和result.txt正文哈希
+    """
 
-def reclassify_reclassify_txt():
-    """对reclassify.txt进行重分类生成result.txt"""
+    def __init__(self, path=GROUP_MANIFEST_FILE, positive_ttl=PROBE_CACHE_POSITIVE_TTL,
+                 negative_ttl=PROBE_CACHE_NEGATIVE_TTL):
+        self.path = path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.groups = {}
+        self.previous = {}
+        self.rules = None
+        self.result = None
+        self.changed = None
+
+    def load(self):
+        """从磁盘加载清单，文件不存在或损坏时视为首次运行"""
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.groups = data.get('groups', {})
+                self.rules = data.get('rules')
+                self.result = data.get('result')
+            except (OSError, ValueError, AttributeError) as e:
+                warning_log(f"读取分组清单失败: {e}")
+                self.groups = {}
+        self.previous = dict(self.groups)
+        debug_log(f"加载分组清单: {len(self.groups)} 个分组")
+        return self
+
+    def fresh_verdict(self, group_name, digest, now=None):
+        """分组内容未变化且结果未过期时返回上次的结果，否则返回None"""
+        now = time.time() if now is None else now
+        entry = self.groups.get(group_name)
+        if entry is None or entry['hash'] != digest:
+            return None
+        ttl = self.positive_ttl if entry['valid'] else self.negative_ttl
+        if now - entry['checked_at'] >= ttl:
+            return None
+        return entry['valid']
+
+    @staticmethod
+    def segment_key(group_name, index):
+        """
+        同名分组在多个上游中出现时，每一段分别记录：第一段使用分组名，之后的段使用"分组名#序号"
+        """
+        return group_name if index == 0 else f"{group_name}#{index + 1}"
+
+    def record(self, key, digest, valid, now=None, group_name=None):
+        """记录分组（或分组的一段）的检测结果"""
+        entry = {
+            'hash': digest,
+            'valid': bool(valid),
+            'checked_at': time.time() if now is None else now,
+        }
+        if group_name is not None and group_name != key:
+            entry['group'] = group_name
+        self.groups[key] = entry
+
+    def finish(self, keys):
+        """删除已消失的分组，计算内容或有效性发生变化的分组名集合"""
+        current = set(keys)
+        changed = {key for key in self.previous if key not in current}
+        for key in current:
+            previous = self.previous.get(key)
+            entry = self.groups.get(key)
+            if previous is None or entry is None or previous['hash'] != entry['hash'] \
+                    or previous['valid'] != entry['valid']:
+                changed.add(key)
+        changed = {(self.groups.get(key) or self.previous.get(key) or {}).get('group', key) for key in changed}
+        self.groups = {key: entry for key, entry in self.groups.items() if key in current}
+        self.changed = changed
+        return changed
+
+    def save(self):
+        """写回磁盘（先写临时文件再原子替换）"""
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'rules': self.rules, 'result': self.result, 'groups': self.groups},
+                      f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+class GroupValidator:
+    """
+    分组有效性检测器：分组一就绪即可提交探测，最后按输入顺序收集结果
+    同一转发服务器（主机:端口）的分组共享一次探测；
+    提供清单时（增量模式），内容未变化且结果未过期的分组直接沿用上次的结果
+    """
+
+    def __init__(self, scheduler, dedupe_hosts=True, sample_size=GROUP_SAMPLE_SIZE,
+                 quorum=GROUP_QUORUM, per_channel=VALIDATE_EACH_CHANNEL, manifest=None):
+        self.scheduler = scheduler
+        self.manifest = None if per_channel else manifest
+        self.digests = {}
+        self.reused = set()
+        self.dedupe_hosts = dedupe_hosts and not per_channel
+        self.sample_size = max(1, sample_size)
+        self.quorum = quorum
+        self.per_channel = per_channel
+        self.tasks = {}
+        self.endpoint_tasks = {}
+        self.probed = 0
+        self.first_submit_at = None
+
+    @property
+    def ready_size(self):
+        """分组解析出多少个频道后即可开始探测（None表示需要完整分组）"""
+        if self.per_channel or self.manifest is not None:
+            return None
+        return self.sample_size
+
+    def submit(self, group_name, channels):
+        """
+        提交一个分组的检测任务（必须在事件循环线程中调用）
+        同名分组再次提交时（多个上游中的同名分组）作为该分组的另一段单独检测
+        """
+        if not channels:
+            return
+        if self.first_submit_at is None:
+            self.first_submit_at = time.perf_counter()
+        segments = self.tasks.setdefault(group_name, [])
+        key = GroupManifest.segment_key(group_name, len(segments))
+
+        if self.per_channel:
+            # 逐频道模式：每个频道单独判定，所有探测共享同一并发额度
+            segments.append((key, channels, asyncio.ensure_future(
+                check_group_channels(group_name, channels, self.scheduler)
+            )))
+            self.probed += 1
+            return
+
+        if self.manifest is not None:
+            digest = self.digests[key] = group_hash(channels)
+            verdict = self.manifest.fresh_verdict(key, digest)
+            if verdict is not None:
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(verdict)
+                segments.append((key, channels, future))
+                self.reused.add(key)
+                return
+
+        first_channel_url = channels[0].url
+        endpoint = get_stream_host(first_channel_url) or first_channel_url
+        task = self.endpoint_tasks.get(endpoint) if self.dedupe_hosts else None
+        if task is None:
+            task = asyncio.ensure_future(check_group_validity(
+                group_name, channels, self.scheduler, sample_size=self.sample_size, quorum=self.quorum
+            ))
+            self.probed += 1
+            if self.dedupe_hosts:
+                self.endpoint_tasks[endpoint] = task
+        segments.append((key, channels, task))
+
+    async def collect(self, groups):
+        """
+        等待所有检测完成，按分组的输入顺序返回有效分组
+        分多段检测的分组只保留有效段中的频道
+        """
+        valid_groups = {}
+        names = [group_name for group_name in groups if group_name in self.tasks]
+        segments = [(group_name, key, channels, task)
+                    for group_name in names for key, channels, task in self.tasks[group_name]]
+        results = await asyncio.gather(*(task for _, _, _, task in segments), return_exceptions=True)
+
+        valid_parts = defaultdict(list)
+        for (group_name, key, channels, _), result in zip(segments, results):
+            if isinstance(result, BaseException):
+                warning_log(f"检测分组 '{key}' 时发生异常: {result}")
+            elif self.per_channel:
+                if result:
+                    valid_parts[group_name].append(result)
+            elif result:
+                valid_parts[group_name].append(channels)
+        for group_name in names:
+            parts = valid_parts.get(group_name)
+            if not parts:
+                continue
+            if not self.per_channel and len(parts) == len(self.tasks[group_name]):
+                valid_groups[group_name] = groups[group_name]
+            else:
+                valid_groups[group_name] = parts[0] if len(parts) == 1 else [
+                    channel for part in parts for channel in part]
+
+        if self.manifest is not None:
+            for (group_name, key, _, _), result in zip(segments, results):
+                if key not in self.reused:
+                    # 检测异常的分组按无效记录，与本次输出保持一致
+                    self.manifest.record(key, self.digests[key],
+                                         False if isinstance(result, BaseException) else result,
+                                         group_name=group_name)
+            changed = self.manifest.finish(key for _, key, _, _ in segments)
+            debug_log(f"增量模式: 沿用 {len(self.reused)} 组结果，变化 {len(changed)} 组")
+
+        saved = len(segments) - self.probed - len(self.reused)
+        cache = self.scheduler.cache
+        if cache is not None:
+            debug_log(f"探测缓存: 命中 {cache.hits} 次，未命中 {cache.misses} 次")
+        health = self.scheduler.health
+        if health.short_circuited or health.hosts_down:
+            debug_log(f"熔断主机: {health.hosts_down} 个，快速失败 {health.short_circuited} 次")
+        metrics = self.scheduler.metrics
+        if metrics is not None:
+            if self.first_submit_at is not None:
+                metrics.add_stage_time('probe', time.perf_counter() - self.first_submit_at)
+            metrics.counters.update({
+                'groups': len(names),
+                'valid_groups': len(valid_groups),
+                'group_checks': self.probed,
+                'group_checks_saved': saved,
+                'groups_reused': len(self.reused),
+                'hosts_down': health.hosts_down,
+                'probes_short_circuited': health.short_circuited,
+            })
+            if cache is not None:
+                metrics.counters.update({'cache_hits': cache.hits, 'cache_misses': cache.misses})
+        if self.per_channel:
+            debug_log(f"有效性检测完成，有效分组: {len(valid_groups)} 个，"
+                      f"有效频道: {sum(len(channels) for channels in valid_groups.values())} 个")
+        else:
+            debug_log(f"有效性检测完成，有效分组: {len(valid_groups)} 个，检测 {self.probed} 组（节省 {saved} 组）")
+        return valid_groups
+
+async def filter_valid_groups_async(groups, max_concurrency=MAX_CONCURRENT_PROBES, per_host_limit=MAX_PROBES_PER_HOST,
+                                    cache=None, dedupe_hosts=True, sample_size=GROUP_SAMPLE_SIZE,
+                                    quorum=GROUP_QUORUM, per_channel=VALIDATE_EACH_CHANNEL, manifest=None,
+                                    metrics=None, health=None):
+    """使用asyncio并发过滤有效的分组"""
+    debug_log(f"开始并发检测流有效性 (总并发 {max_concurrency}，单主机并发 {per_host_limit})...")
+    debug_log(f"共有 {sum(1 for channels in groups.values() if channels)} 个分组需要检测")
+
+    scheduler = ProbeScheduler(max_concurrency, per_host_limit, cache, metrics, health)
+    validator = GroupValidator(scheduler, dedupe_hosts, sample_size, quorum, per_channel, manifest)
+    for group_name, channels in groups.items():
+        validator.submit(group_name, channels)
+    return await validator.collect(groups)
+
+def filter_valid_groups(groups, max_concurrency=MAX_CONCURRENT_PROBES, per_host_limit=MAX_PROBES_PER_HOST,
+                        cache=None, dedupe_hosts=True, sample_size=GROUP_SAMPLE_SIZE,
+                        quorum=GROUP_QUORUM, per_channel=VALIDATE_EACH_CHANNEL, manifest=None, metrics=None,
+                        health=None):
+    """过滤有效的分组（同步入口）"""
+    return asyncio.run(filter_valid_groups_async(
+        groups, max_concurrency, per_host_limit, cache, dedupe_hosts, sample_size, quorum, per_channel, manifest,
+        metrics, health
+    ))
+
+async def stream_valid_groups_async(lines, max_concurrency=MAX_CONCURRENT_PROBES, per_host_limit=MAX_PROBES_PER_HOST,
+                                    cache=None, dedupe_hosts=True, sample_size=GROUP_SAMPLE_SIZE,
+                                    quorum=GROUP_QUORUM, per_channel=VALIDATE_EACH_CHANNEL, manifest=None,
+                                    metrics=None, health=None, deduplicator=None):
+    """
+    流水线模式：在后台线程中边读取边解析，分组一就绪就在事件循环中开始探测
+    提供deduplicator时重复地址的频道在解析时即被丢弃，不参与探测
+    返回 (全部分组, 有效分组)
+    """
+    debug_log(f"开始流水线解析与检测 (总并发 {max_concurrency}，单主机并发 {per_host_limit})...")
+
+    loop = asyncio.get_running_loop()
+    scheduler = ProbeScheduler(max_concurrency, per_host_limit, cache, metrics, health)
+    validator = GroupValidator(scheduler, dedupe_hosts, sample_size, quorum, per_channel, manifest)
+
+    def on_group_ready(group_name, channels):
+        loop.call_soon_threadsafe(validator.submit, group_name, channels)
+
+    # 解析线程中提交的回调都会先于本协程恢复执行
+    started = time.perf_counter()
+    download_before = metrics.stages.get('download', 0.0) if metrics is not None else 0.0
+    groups = await asyncio.to_thread(parse_groups, lines, on_group_ready, validator.ready_size, deduplicator)
+    if metrics is not None:
+        # 解析线程的耗时中包含等待下载数据的时间，需要扣除
+        download_elapsed = metrics.stages.get('download', 0.0) - download_before
+        metrics.add_stage_time('parse', time.perf_counter() - started - download_elapsed)
+    return groups, await validator.collect(groups)
+
+def stream_valid_groups(lines, max_concurrency=MAX_CONCURRENT_PROBES, per_host_limit=MAX_PROBES_PER_HOST,
+                        cache=None, dedupe_hosts=True, sample_size=GROUP_SAMPLE_SIZE,
+                        quorum=GROUP_QUORUM, per_channel=VALIDATE_EACH_CHANNEL, manifest=None, metrics=None,
+                        health=None, deduplicator=None):
+    """流水线解析与检测（同步入口）"""
+    return asyncio.run(stream_valid_groups_async(
+        lines, max_concurrency, per_host_limit, cache, dedupe_hosts, sample_size, quorum, per_channel, manifest,
+        metrics, health, deduplicator
+    ))
+
+class StreamQuality:
+    """一个播放地址的质量测量结果，无法测量的项为None"""
+    __slots__ = ('ttfb', 'bitrate', 'width', 'height')
+
+    def __init__(self, ttfb=None, bitrate=None, width=None, height=None):
+        self.ttfb = ttfb
+        self.bitrate = bitrate
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return f"StreamQuality(ttfb={self.ttfb!r}, bitrate={self.bitrate!r}, width={self.width!r}, height={self.height!r})"
+
+    def sort_key(self):
+        """排序键：未测得首字节的排最后，其次首字节时间（按桶），再按分辨率、码率从高到低"""
+        if self.ttfb is None:
+            return (1, 0, 0, 0)
+        return (0, int(self.ttfb / QUALITY_TTFB_BUCKET), -(self.height or 0), -(self.bitrate or 0))
+
+    def to_dict(self):
+        return {
+            'ttfb': round(self.ttfb, 4) if self.ttfb is not None else None,
+            'bitrate': int(self.bitrate) if self.bitrate is not None else None,
+            'width': self.width,
+            'height': self.height,
+        }
+
+async def measure_http_stream(url, window=QUALITY_READ_SECONDS, timeout=5):
+    """
+    读取流开头的数据：返回 (首字节时间, 码率bit/s)
+    首字节时间为发送请求到收到第一个正文字节的时间，码率按之后window秒内收到的数据计算
+    """
     try:
-        debug_log("=== 开始重分类 reclassify.txt ===")
-        
-        # 读取reclassify.txt文件
-        if not os.path.exists('reclassify.txt'):
-            debug_log("错误: reclassify.txt 文件不存在")
-            return False
-        
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+    except ValueError:
+        return None, None
+    if parts.scheme != 'http' or not host:
+        return None, None
+
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None, None
+
+    try:
+        started = time.perf_counter()
+        writer.write(
+            f"GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\nUser-Agent: {PROBE_USER_AGENT}\r\n"
+            f"Connection: close\r\n\r\n".encode('utf-8')
+        )
+        await writer.drain()
+
+        header = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=timeout)
+        status_line = header.split(b"\r\n", 1)[0].split()
+        if len(status_line) < 2 or status_line[1] != b'200':
+            return None, None
+        first = await asyncio.wait_for(reader.read(PROBE_READ_BYTES), timeout=timeout)
+        if not first:
+            return None, None
+        ttfb = time.perf_counter() - started
+
+        received = 0
+        window_started = time.perf_counter()
+        deadline = window_started + window
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(reader.read(65536), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            received += len(chunk)
+        elapsed = time.perf_counter() - window_started
+        return ttfb, received * 8 / elapsed if elapsed > 0 else None
+
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+        return None, None
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+async def probe_resolution(url, timeout=5):
+    """使用ffprobe读取第一路视频的分辨率，返回 (宽, 高)，失败时返回 (None, None)"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "stream=width,height", "-of", "json", "-i", url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+    except Exception:
+        return None, None
+
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout=timeout + 2)
+        streams = json.loads(stdout or b'{}').get('streams') or [{}]
+        return streams[0].get('width'), streams[0].get('height')
+    except (asyncio.TimeoutError, ValueError, AttributeError):
+        return None, None
+    finally:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+def ranking_candidates(valid_groups):
+    """
+    返回需要测量质量的播放地址：与rank_channels的分组方式相同（已分类的频道按分类和标准化名称，
+    未分类的频道按原名称），同一名称下有多个不同地址时才需要测量
+    """
+    urls_by_name = defaultdict(dict)
+    for channels in valid_groups.values():
+        for channel in channels:
+            normalized_name = normalize_channel_name(channel.name)
+            category = CATEGORY_INDEX.get(normalized_name)
+            key = (category, normalized_name) if category is not None else (None, channel.name)
+            urls_by_name[key][channel.url] = None
+    return [url for urls in urls_by_name.values() if len(urls) > 1 for url in urls]
+
+async def measure_quality_async(valid_groups, max_concurrency=MAX_CONCURRENT_PROBES,
+                                per_host_limit=MAX_PROBES_PER_HOST, resolution=True, metrics=None):
+    """
+    测量有效分组中需要排序的播放地址的质量（相同地址只测一次），返回 地址 -> StreamQuality
+    只有一个地址的频道无需排序，不做测量
+    """
+    urls = ranking_candidates(valid_groups)
+    debug_log(f"开始测量 {len(urls)} 个播放地址的质量 (读取 {QUALITY_READ_SECONDS} 秒)...")
+
+    scheduler = ProbeScheduler(max_concurrency, per_host_limit)
+
+    async def measure(url):
+        async with scheduler.host_semaphore(url):
+            async with scheduler.semaphore:
+                ttfb, bitrate = await measure_http_stream(url)
+                width = height = None
+                # 无法读取数据的地址不再运行ffprobe
+                if resolution and ttfb is not None:
+                    width, height = await probe_resolution(url)
+        verbose_log("  质量: %s 首字节 %s 码率 %s 分辨率 %sx%s", url, ttfb, bitrate, width, height)
+        return StreamQuality(ttfb, bitrate, width, height)
+
+    results = await asyncio.gather(*(measure(url) for url in urls))
+    quality = dict(zip(urls, results))
+
+    measured = sum(1 for result in results if result.ttfb is not None)
+    debug_log(f"质量测量完成: 成功 {measured} 个，失败 {len(urls) - measured} 个")
+    if metrics is not None:
+        metrics.counters.update({'quality_measured': measured, 'quality_failed': len(urls) - measured})
+    return quality
+
+def measure_quality(valid_groups, max_concurrency=MAX_CONCURRENT_PROBES, per_host_limit=MAX_PROBES_PER_HOST,
+                    resolution=True, metrics=None):
+    """测量播放地址质量（同步入口）"""
+    return asyncio.run(measure_quality_async(valid_groups, max_concurrency, per_host_limit, resolution, metrics))
+
+def write_quality(quality, path=QUALITY_FILE):
+    """写入每个播放地址的质量测量结果（先写临时文件再原子替换）"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({url: result.to_dict() for url, result in quality.items()}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    debug_log(f"生成文件: {path}")
+
+def iter_output_lines(valid_groups):
+    """逐行生成输出内容"""
+    debug_log("生成输出内容...")
+
+    for group_name, channels in valid_groups.items():
+        verbose_log("处理分组 '%s' 的 %d 个频道", group_name, len(channels))
+        for channel in channels:
+            # 在播放地址后加入$所属组名
+            yield channel.to_line()
+
+def write_output(valid_groups, path='reclassify.txt'):
+    """逐行写入输出文件（先写临时文件再原子替换），返回写入的行数"""
+    count = 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for output_line in iter_output_lines(valid_groups):
+            if count:
+                f.write('\n')
+            f.write(output_line)
+            count += 1
+    os.replace(tmp_path, path)
+    debug_log(f"共生成 {count} 行输出")
+    return count
+
+class ChannelNameIndex:
+    """
+    预编译的频道名称索引
+
+    与逐项扫描CHANNEL_NAME_MAPPING的结果完全一致（先精确匹配，再按映射顺序模糊匹配，先匹配者优先）：
+    - 精确匹配: 变体 -> 标准名称 的字典
+    - 模糊匹配"变体包含于名称": 小写变体构成的Aho-Corasick自动机
+    - 模糊匹配"名称包含于变体": 小写变体所有子串 -> 最小序号 的字典
+    """
+
+    def __init__(self, mapping):
+        self.standard_names = []
+        self.exact = {}
+        # 每个(标准名称, 变体)按映射顺序编号，序号越小优先级越高
+        self.goto = [{}]
+        self.fail = [0]
+        self.best = [None]
+        self.substrings = {}
+
+        order = 0
+        for standard_name, variants in mapping.items():
+            for variant in variants:
+                self.exact.setdefault(variant, standard_name)
+                self.standard_names.append(standard_name)
+                lowered = variant.lower()
+                self._add_pattern(lowered, order)
+                for start in range(len(lowered) + 1):
+                    for end in range(start, len(lowered) + 1):
+                        self.substrings.setdefault(lowered[start:end], order)
+                order += 1
+
+        self._build_fail_links()
+
+    def _add_pattern(self, pattern, order):
+        """向自动机中添加一个模式串"""
+        node = 0
+        for char in pattern:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.best.append(None)
+            node = next_node
+        if self.best[node] is None or order < self.best[node]:
+            self.best[node] = order
+
+    def _build_fail_links(self):
+        """广度优先构建失败指针，并沿失败链合并每个节点可匹配的最小序号"""
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                inherited = self.best[self.fail[child]]
+                if inherited is not None and (self.best[child] is None or inherited < self.best[child]):
+                    self.best[child] = inherited
+
+    def _search(self, text):
+        """返回text中出现的变体的最小序号"""
+        goto, fail, best = self.goto, self.fail, self.best
+        # 空模式串（空变体）可匹配任何名称
+        found = best[0]
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            order = best[node]
+            if order is not None and (found is None or order < found):
+                found = order
+        return found
+
+    def lookup(self, channel_name_clean):
+        """查找标准名称，未匹配时返回None"""
+        standard_name = self.exact.get(channel_name_clean)
+        if standard_name is not None:
+            return standard_name
+
+        lowered = channel_name_clean.lower()
+        found = self._search(lowered)
+        contained = self.substrings.get(lowered)
+        if contained is not None and (found is None or contained < found):
+            found = contained
+
+        if found is None:
+            return None
+        return self.standard_names[found]
+
+    def to_state(self):
+        """导出为只含基本类型的数据，用于写入编译缓存"""
+        return {
+            'standard_names': self.standard_names,
+            'exact': self.exact,
+            'goto': self.goto,
+            'fail': self.fail,
+            'best': self.best,
+            'substrings': self.substrings,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """从编译缓存恢复索引，不再重新构建自动机"""
+        index = cls.__new__(cls)
+        for name, value in state.items():
+            setattr(index, name, value)
+        return index
+
+def normalize_channel_name(channel_name, index=None):
+    """标准化频道名称"""
+    channel_name_clean = channel_name.strip()
+
+    standard_name = (index or CHANNEL_NAME_INDEX).lookup(channel_name_clean)
+    if standard_name is not None:
+        return standard_name
+
+    return channel_name_clean
+
+def build_category_index(mapping):
+    """构建 频道名称 -> 分类编号 的反向索引（按字典顺序先出现的分类优先），编号即分类在字典中的位置"""
+    index = {}
+    for category_id, channels in enumerate(mapping.values()):
+        for channel in channels:
+            index.setdefault(channel, category_id)
+    return index
+
+def find_duplicate_category_names(mapping):
+    """找出被列在多个分类中的频道名称，返回 名称 -> 分类列表"""
+    seen = defaultdict(list)
+    for category, channels in mapping.items():
+        for channel in channels:
+            if category not in seen[channel]:
+                seen[channel].append(category)
+    return {channel: categories for channel, categories in seen.items() if len(categories) > 1}
+
+def validate_category_mapping(mapping=None):
+    """校验分类映射，报告重复归属的频道名称"""
+    duplicates = find_duplicate_category_names(CATEGORY_MAPPING if mapping is None else mapping)
+    for channel, categories in duplicates.items():
+        warning_log(f"警告: 频道 '{channel}' 同时属于多个分类 {categories}，将归入 '{categories[0]}'")
+    return not duplicates
+
+def read_rules(path=RULES_FILE):
+    """读取并校验规则文件，返回 (分类映射, 频道名称映射)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        rules = json.load(f)
+
+    if rules.get('version') != RULES_FORMAT_VERSION:
+        raise ValueError(f"{path}: 不支持的规则文件版本 {rules.get('version')!r}")
+    mappings = []
+    for key in ('categories', 'channel_names'):
+        mapping = rules.get(key)
+        if not isinstance(mapping, dict) or not all(
+                isinstance(name, str) and isinstance(values, list) and all(isinstance(value, str) for value in values)
+                for name, values in mapping.items()):
+            raise ValueError(f"{path}: '{key}' 必须是 名称 -> 字符串列表 的对象")
+        mappings.append(mapping)
+    return tuple(mappings)
+
+def file_hash(path):
+    """文件内容的sha1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def compile_rules(path=RULES_FILE, digest=None):
+    """编译规则文件：精确映射、模糊匹配自动机和分类表，返回可直接pickle的字典"""
+    category_mapping, channel_name_mapping = read_rules(path)
+    return {
+        'version': RULES_INDEX_VERSION,
+        'rules_hash': digest or file_hash(path),
+        'category_mapping': category_mapping,
+        'channel_name_mapping': channel_name_mapping,
+        'name_index': ChannelNameIndex(channel_name_mapping).to_state(),
+        'category_names': list(category_mapping),
+        'category_index': build_category_index(category_mapping),
+    }
+
+def load_rules(path=RULES_FILE, index_path=RULES_INDEX_FILE, force=False):
+    """
+    加载编译后的规则：规则文件哈希和缓存版本都一致时直接读取编译缓存，
+    否则重新编译并写入缓存（写入失败不影响本次运行）
+    """
+    digest = file_hash(path)
+    if not force and os.path.exists(index_path):
+        try:
+            with open(index_path, 'rb') as f:
+                compiled = pickle.load(f)
+            if compiled.get('version') == RULES_INDEX_VERSION and compiled.get('rules_hash') == digest:
+                return compiled
+        except Exception as e:
+            verbose_log("规则编译缓存无法读取，重新编译: %s", e)
+
+    compiled = compile_rules(path, digest)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+        debug_log(f"已编译规则文件: {path} -> {index_path}")
+    except OSError as e:
+        warning_log(f"无法写入规则编译缓存 {index_path}: {e}")
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+    return compiled
+
+# 导入时加载一次（规则文件未变化时直接读取编译缓存，不再构建索引）
+_compiled_rules = load_rules()
+CATEGORY_MAPPING = _compiled_rules['category_mapping']
+CHANNEL_NAME_MAPPING = _compiled_rules['channel_name_mapping']
+CHANNEL_NAME_INDEX = ChannelNameIndex.from_state(_compiled_rules['name_index'])
+CATEGORY_NAMES = _compiled_rules['category_names']
+CATEGORY_INDEX = _compiled_rules['category_index']
+del _compiled_rules
+
+CHANNEL_LINE_PATTERN = re.compile(r'^([^,]+),([^$]+)\$([^$]+)$')
+
+def parse_channel_line(channel_line):
+    """解析频道行 - 格式是: 频道名称,地址$地区运营商，无法解析时返回None"""
+    match = CHANNEL_LINE_PATTERN.match(channel_line)
+    if not match:
+        return None
+    return Channel(*match.groups())
+
+def iter_channel_records(valid_groups):
+    """从有效分组直接产出频道记录，规则与解析reclassify.txt时一致"""
+    for channels in valid_groups.values():
+        for channel in channels:
+            if not channel.name or ',' in channel.name or not channel.url or '$' in channel.url \
+                    or not channel.region or '$' in channel.region:
+                verbose_log("无法解析频道行: %s", channel)
+                continue
+            yield channel
+
+# 分类子进程中的索引，由初始化函数设置一次
+_worker_name_index = None
+_worker_category_index = None
+
+def _init_categorize_worker(name_index, category_index):
+    """分类子进程初始化：接收一次名称索引和分类索引"""
+    global _worker_name_index, _worker_category_index
+    _worker_name_index = name_index
+    _worker_category_index = category_index
+
+def _categorize_names(names):
+    """在子进程中分类一段连续的频道名称，返回 (标准化名称, 分类编号) 列表"""
+    results = []
+    seen = {}
+    for name in names:
+        result = seen.get(name)
+        if result is None:
+            normalized_name = normalize_channel_name(name, _worker_name_index)
+            result = seen[name] = (normalized_name, _worker_category_index.get(normalized_name))
+        results.append(result)
+    return results
+
+def classify_names_parallel(names, workers=None, chunk_size=PARALLEL_CATEGORIZE_CHUNK_SIZE):
+    """多进程分类：按连续分块分发，按输入顺序合并结果"""
+    chunks = [names[start:start + chunk_size] for start in range(0, len(names), chunk_size)]
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        initializer=_init_categorize_worker,
+        initargs=(CHANNEL_NAME_INDEX, CATEGORY_INDEX),
+    ) as executor:
+        # map按提交顺序返回结果，保证合并后的顺序与输入一致
+        return list(itertools.chain.from_iterable(executor.map(_categorize_names, chunks)))
+
+def categorize_records(records, workers=None, threshold=PARALLEL_CATEGORIZE_THRESHOLD):
+    """
+    根据分类规则对频道记录重新分类，返回 分类 -> 频道列表 和未分类频道列表
+    频道数达到threshold且有多个CPU时使用多进程分类（workers=1强制串行），每个分类内保持输入顺序
+    """
+    debug_log("开始分类频道...")
+    categorized = defaultdict(list)
+    uncategorized = []
+
+    classified = None
+    if (workers or os.cpu_count() or 1) > 1:
+        records = list(records)
+        if len(records) >= threshold:
+            debug_log(f"频道数 {len(records)} 较多，使用多进程分类")
+            try:
+                classified = classify_names_parallel([channel.name for channel in records], workers)
+            except (OSError, concurrent.futures.process.BrokenProcessPool) as e:
+                warning_log(f"多进程分类失败，改为串行: {e}")
+
+    for index, channel in enumerate(records):
+        if classified is not None:
+            channel.normalized_name, channel.category = classified[index]
+        else:
+            channel.normalized_name = normalize_channel_name(channel.name)
+            # 查找分类
+            channel.category = CATEGORY_INDEX.get(channel.normalized_name)
+
+        if channel.category is not None:
+            categorized[CATEGORY_NAMES[channel.category]].append(channel)
+        else:
+            uncategorized.append(channel)
+
+    debug_log(f"分类完成: 已分类 {sum(len(channels) for channels in categorized.values())}, 未分类 {len(uncategorized)}")
+    return categorized, uncategorized
+
+def categorize_channels(formatted_channels):
+    """根据分类规则重新分类频道"""
+    if not formatted_channels:
+        debug_log("没有频道需要分类")
+        return {}, []
+
+    deduplicator = ChannelDeduplicator()
+    result = categorize_records(iter_formatted_records(formatted_channels, deduplicator))
+    deduplicator.log_summary()
+    return result
+
+def iter_formatted_records(formatted_channels, deduplicator=None):
+    """解析 频道名称,地址$地区运营商 格式的频道行，跳过无法解析和地址重复的行"""
+    for channel_line in formatted_channels:
+        record = parse_channel_line(channel_line)
+        if record is None:
+            verbose_log("无法解析频道行: %s", channel_line)
+            continue
+        if deduplicator is not None and not deduplicator.add(record.url, record.name):
+            verbose_log("重复地址，跳过: %s", channel_line)
+            continue
+        yield record
+
+class CategorySpill:
+    """
+    分类结果的外部溢出存储：每个分类（及未分类）的频道记录格式化为结果行追加写入各自的临时文件，
+    写结果时按CATEGORY_MAPPING的顺序分块读回为频道记录，内存占用与输入规模无关
+    """
+
+    def __init__(self, directory=None):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix='reclassify-spill-', dir=directory)
+        self.files = {}
+        self.counts = defaultdict(int)
+
+    def append(self, category, channel):
+        spill_file = self.files.get(category)
+        if spill_file is None:
+            path = os.path.join(self.tmpdir.name, f"{len(self.files)}.txt")
+            spill_file = self.files[category] = open(path, 'w+', encoding='utf-8', buffering=EXPORT_BUFFER_SIZE)
+        spill_file.write(channel.to_result_line())
+        spill_file.write('\n')
+        self.counts[category] += 1
+
+    def iter_chunks(self, category, chunk_size=SPILL_CHUNK_LINES):
+        """按写入顺序分块读回一个分类的频道记录"""
+        spill_file = self.files.get(category)
+        if spill_file is None:
+            return
+        spill_file.flush()
+        spill_file.seek(0)
+        chunk = []
+        for line in spill_file:
+            chunk.append(Channel.from_result_line(line[:-1]))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def iter_sections(self):
+        """按输出顺序产出 (分类, 是否未分类, 频道记录分块)，供export_chunks使用"""
+        for category in CATEGORY_MAPPING.keys():
+            yield category, False, self.iter_chunks(category)
+        yield UNCATEGORIZED_CATEGORY, True, self.iter_chunks(UNCATEGORIZED_CATEGORY)
+
+    @property
+    def uncategorized_count(self):
+        return self.counts.get(UNCATEGORIZED_CATEGORY, 0)
+
+    @property
+    def categorized_count(self):
+        return sum(self.counts.values()) - self.uncategorized_count
+
+    def close(self):
+        for spill_file in self.files.values():
+            spill_file.close()
+        self.files.clear()
+        self.tmpdir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def categorize_to_spill(records, spill):
+    """逐条分类频道记录并立即写入溢出文件，不在内存中保留分类结果"""
+    debug_log("开始分类频道（溢出模式）...")
+    for channel in records:
+        channel.normalized_name = normalize_channel_name(channel.name)
+        channel.category = CATEGORY_INDEX.get(channel.normalized_name)
+        category = CATEGORY_NAMES[channel.category] if channel.category is not None else UNCATEGORIZED_CATEGORY
+        spill.append(category, channel)
+    debug_log(f"分类完成: 已分类 {spill.categorized_count}, 未分类 {spill.uncategorized_count}")
+
+# result.txt 未分类频道的分组标题
+UNCATEGORIZED_CATEGORY = '其他频道,#genre#'
+# result.txt 文件头行数（含空行）
+RESULT_HEADER_LINES = 4
+
+# 导出文件的写缓冲大小
+EXPORT_BUFFER_SIZE = 1 << 16
+
+class Exporter:
+    """
+    导出格式基类：先写临时文件，全部写完后原子替换为目标文件
+    begin写文件头，section写一个分类（uncategorized表示未分类频道），end写文件尾
+    """
+    extension = None
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.file = None
+
+    def open(self, generated_at):
+        self.file = open(self.tmp_path, 'w', encoding='utf-8', buffering=EXPORT_BUFFER_SIZE)
+        self.begin(generated_at)
+
+    def begin(self, generated_at):
+        pass
+
+    def start_section(self, category, uncategorized=False):
+        pass
+
+    def write_channels(self, channels):
+        """写入一个分类的一批频道记录（同一分类可能分多批写入），名称使用Channel.result_name"""
+        raise NotImplementedError
+
+    def end_section(self, uncategorized=False):
+        pass
+
+    def end(self):
+        pass
+
+    def commit(self):
+        self.end()
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+        with contextlib.suppress(OSError):
+            os.remove(self.tmp_path)
+
+class TxtExporter(Exporter):
+    """result.txt格式：分类,#genre# 加 频道名称,地址$地区运营商；记录正文sha1供增量模式校验"""
+    extension = 'txt'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.digest = hashlib.sha1()
+
+    def begin(self, generated_at):
+        self.file.write(f"# 直播源重分类结果\n")
+        self.file.write(f"# 生成时间: {generated_at.strftime('%Y-%m-%d %H:%M:%S')} (北京时间)\n")
+        self.file.write(f"# 数据来源: https://github.com/q1017673817/iptvz/blob/main/zubo_all.txt\n\n")
+
+    def write(self, text):
+        self.file.write(text)
+        self.digest.update(text.encode('utf-8'))
+
+    def start_section(self, category, uncategorized=False):
+        self.write(f"{category}\n")
+
+    def write_channels(self, channels):
+        # 每批频道行合并后写入一次
+        self.write(''.join(f"{channel.to_result_line()}\n" for channel in channels))
+
+    def end_section(self, uncategorized=False):
+        # 未分类频道在最后，后面不加空行
+        if not uncategorized:
+            self.write("\n")
+
+class M3uExporter(Exporter):
+    """M3U8播放列表：分类写入group-title，频道名称写入tvg-name"""
+    extension = 'm3u8'
+
+    def begin(self, generated_at):
+        self.file.write("#EXTM3U\n")
+
+    def start_section(self, category, uncategorized=False):
+        self.group_title = category.split(',', 1)[0].replace('"', "'")
+
+    def write_channels(self, channels):
+        chunk = []
+        for channel in channels:
+            name = channel.result_name
+            tvg_name = name.replace('"', "'")
+            chunk.append(f'#EXTINF:-1 tvg-name="{tvg_name}" group-title="{self.group_title}",{name}\n{channel.url}\n')
+        self.file.write(''.join(chunk))
+
+class JsonExporter(Exporter):
+    """JSON格式：{"generated_at": ..., "categories": [{"name": ..., "channels": [{name, url, region}]}]}，逐个分类写出"""
+    extension = 'json'
+
+    def begin(self, generated_at):
+        self.file.write('{"generated_at": ' + json.dumps(generated_at.isoformat(timespec='seconds'))
+                        + ', "categories": [')
+        self.first_section = True
+
+    def start_section(self, category, uncategorized=False):
+        self.file.write(('' if self.first_section else ',') + '\n{"name": '
+                        + json.dumps(category.split(',', 1)[0], ensure_ascii=False)
+                        + ', "uncategorized": ' + json.dumps(uncategorized) + ', "channels": [')
+        self.first_section = False
+        self.first_channel = True
+
+    def write_channels(self, channels):
+        chunk = ',\n'.join(
+            json.dumps({'name': channel.result_name, 'url': channel.url, 'region': channel.region}, ensure_ascii=False)
+            for channel in channels
+        )
+        self.file.write(('\n' if self.first_channel else ',\n') + chunk)
+        self.first_channel = False
+
+    def end_section(self, uncategorized=False):
+        self.file.write(']}')
+
+    def end(self):
+        self.file.write('\n]}\n')
+
+# 可用的导出格式：格式名 -> 导出类，文件名为 result.<扩展名>
+EXPORTERS = {exporter.extension: exporter for exporter in (TxtExporter, M3uExporter, JsonExporter)}
+EXPORT_FORMATS = ('txt',)
+
+def build_exporters(formats=EXPORT_FORMATS, base='result'):
+    """按格式名创建导出器，txt格式总是第一个"""
+    formats = ['txt'] + [name for name in dict.fromkeys(formats) if name != 'txt']
+    return [EXPORTERS[name](f"{base}.{EXPORTERS[name].extension}") for name in formats]
+
+def export_chunks(sections, exporters):
+    """
+    遍历一次分类结果，同时写入所有导出格式；全部写完后逐个原子替换，出错时删除临时文件
+    sections为按输出顺序排列的 (分类, 是否未分类, 频道记录分块的可迭代对象)，没有频道的分类不输出
+    """
+    generated_at = datetime.now(BEIJING_TZ)
+    try:
+        for exporter in exporters:
+            exporter.open(generated_at)
+        for category, uncategorized, chunks in sections:
+            started = False
+            for channels in chunks:
+                if not channels:
+                    continue
+                if not started:
+                    for exporter in exporters:
+                        exporter.start_section(category, uncategorized)
+                    started = True
+                for exporter in exporters:
+                    exporter.write_channels(channels)
+            if started:
+                for exporter in exporters:
+                    exporter.end_section(uncategorized)
+        for exporter in exporters:
+            exporter.commit()
+    except BaseException:
+        for exporter in exporters:
+            exporter.abort()
+        raise
+    for exporter in exporters:
+        debug_log(f"生成文件: {exporter.path}")
+
+def export_sections(sections, uncategorized_channels, exporters):
+    """写入内存中的分类结果：sections为按输出顺序排列的 (分类, 频道记录列表)"""
+    export_chunks(itertools.chain(
+        ((category, False, (channels,)) for category, channels in sections),
+        ((UNCATEGORIZED_CATEGORY, True, (uncategorized_channels,)),),
+    ), exporters)
+
+def rank_channels(channels, quality, top_k=None):
+    """
+    按质量排序一个分类内的频道：同名频道（标准化名称）排在一起，位置为该名称第一次出现的位置，
+    同名频道之间按StreamQuality.sort_key从快到慢排列，top_k限制每个名称保留的地址数
+    """
+    by_name = {}
+    for channel in channels:
+        by_name.setdefault(channel.result_name, []).append(channel)
+
+    unmeasured = StreamQuality()
+    ranked = []
+    for duplicates in by_name.values():
+        # sorted是稳定排序，质量相同时保持输入顺序
+        duplicates = sorted(duplicates, key=lambda channel: quality.get(channel.url, unmeasured).sort_key())
+        ranked.extend(duplicates[:top_k] if top_k else duplicates)
+    return ranked
+
+def build_result_sections(categorized_channels, uncategorized_channels, quality=None, top_k=None):
+    """
+    按照CATEGORY_MAPPING的顺序排列分类结果，返回 ((分类, 频道记录列表) 的列表, 未分类频道记录列表)
+    提供quality时每个分类内的同名频道按质量排序
+    """
+    def ordered(channels):
+        return rank_channels(channels, quality, top_k) if quality is not None else channels
+
+    sections = [(category, ordered(categorized_channels.get(category, ()))) for category in CATEGORY_MAPPING.keys()]
+    return sections, ordered(uncategorized_channels)
+
+def read_result_sections(path='result.txt'):
+    """读取已有的result.txt，返回 (正文sha1, 分类 -> 频道行列表)；文件不存在时返回 (None, {})"""
+    if not os.path.exists(path):
+        return None, {}
+
+    digest = hashlib.sha1()
+    sections = {}
+    current = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            if index < RESULT_HEADER_LINES:
+                continue
+            digest.update(line.encode('utf-8'))
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            if line.endswith(',#genre#'):
+                current = sections.setdefault(line, [])
+            elif current is not None:
+                current.append(line)
+    return digest.hexdigest(), sections
+
+def build_patched_sections(valid_groups, changed_groups, old_sections):
+    """
+    增量重分类：只对变化的分组重新分类，未变化分组的频道直接沿用旧result.txt中的内容
+    每个分类内仍按分组的输入顺序排列，结果与全量重分类一致
+    """
+    old_channels = defaultdict(list)
+    for section, lines in old_sections.items():
+        for line in lines:
+            channel = Channel.from_result_line(line)
+            old_channels[(section, channel.region)].append(channel)
+
+    changed_valid = {group_name: channels for group_name, channels in valid_groups.items()
+                     if group_name in changed_groups}
+    categorized, uncategorized = categorize_records(iter_channel_records(changed_valid))
+    new_channels = defaultdict(list)
+    for category, channels in categorized.items():
+        for channel in channels:
+            new_channels[(category, channel.region)].append(channel)
+    for channel in uncategorized:
+        new_channels[(UNCATEGORIZED_CATEGORY, channel.region)].append(channel)
+
+    def section_channels(section):
+        channels = []
+        for group_name in valid_groups:
+            source = new_channels if group_name in changed_groups else old_channels
+            channels.extend(source.get((section, group_name), ()))
+        return channels
+
+    sections = [(category, section_channels(category)) for category in CATEGORY_MAPPING.keys()]
+    return sections, section_channels(UNCATEGORIZED_CATEGORY)
+
+def reclassify_spilled(manifest=None, formats=EXPORT_FORMATS, deduplicate=True):
+    """
+    溢出模式的重分类：逐行读取reclassify.txt，分类结果只写入各分类的临时文件，写结果时按分类顺序拼接
+    reclassify.txt由本次运行写出（已去重）时deduplicate为False，不再保留全部地址用于去重
+    """
+    if not os.path.exists('reclassify.txt'):
+        warning_log("错误: reclassify.txt 文件不存在")
+        return False
+
+    with CategorySpill() as spill:
+        # 逐行读取，不把整个文件读入内存
+        deduplicator = ChannelDeduplicator() if deduplicate else None
         with open('reclassify.txt', 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        if not content:
-            debug_log("错误: reclassify.txt 文件为空")
-            return False
-        
-        # 解析频道行
-        formatted_channels = [line.strip() for line in content.split('\n') if line.strip()]
-        debug_log(f"从 reclassify.txt 读取到 {len(formatted_channels)} 个频道")
-        
-        if not formatted_channels:
-            debug_log("错误: reclassify.txt 中没有有效的频道行")
-            return False
-        
-        # 重分类
-        categorized_channels, uncategorized_channels = categorize_channels(formatted_channels)
-        
-        if not categorized_channels and not uncategorized_channels:
-            debug_log("错误: 重分类后没有频道")
+            formatted_channels = (line.strip() for line in f)
+            categorize_to_spill(iter_formatted_records(filter(None, formatted_channels), deduplicator), spill)
+        if deduplicator is not None:
+            deduplicator.log_summary()
+
+        if not spill.counts:
+            warning_log("错误: 重分类后没有频道")
             return False
-        
-        # 生成北京时间
-        beijing_time = datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S")
-        
+
+        exporters = build_exporters(formats)
+        export_chunks(spill.iter_sections(), exporters)
+        if manifest is not None:
+            manifest.rules = rules_hash()
+            manifest.result = exporters[0].digest.hexdigest()
+
+        debug_log("=== 重分类完成 ===")
+        debug_log(f"已分类频道数: {spill.categorized_count}")
+        debug_log(f"未分类频道数: {spill.uncategorized_count}")
+        return True
+
+def reclassify_reclassify_txt(valid_groups=None, manifest=None, quality=None, top_k=None, formats=EXPORT_FORMATS,
+                              spill=False, deduplicated=False):
+    """
+    对reclassify.txt进行重分类生成result.txt
+    传入valid_groups时直接使用内存中的频道记录，不再重新读取和解析reclassify.txt
+    传入增量清单时只重新分类变化的分组，并在清单中记录新的result.txt哈希
+    传入quality时同名频道按质量排序（排序依赖全部分组，因此总是全量重分类）
+    formats为要生成的导出格式（txt/m3u8/json），所有格式在同一次遍历中写出
+    spill为True且没有传入valid_groups时逐行读取reclassify.txt，分类结果写入临时文件而不是保留在内存中
+    （质量排序时不适用）；deduplicated表示reclassify.txt已去重
+    """
+    try:
+        debug_log("=== 开始重分类 reclassify.txt ===")
+        validate_category_mapping()
+
+        patched = None
+        if quality is not None and manifest is not None and manifest.changed is not None:
+            debug_log("增量模式: 已启用质量排序，全量重分类")
+        elif valid_groups is not None and manifest is not None and manifest.changed is not None:
+            current_rules = rules_hash()
+            result_digest, old_sections = read_result_sections('result.txt')
+            if manifest.rules is None:
+                debug_log("增量模式: 没有上次运行的记录，全量重分类")
+            elif manifest.rules != current_rules:
+                debug_log("增量模式: 分类规则已变化，全量重分类")
+            elif result_digest is None or result_digest != manifest.result:
+                debug_log("增量模式: result.txt 与清单不一致，全量重分类")
+            else:
+                debug_log(f"增量模式: 只重新分类 {len(manifest.changed)} 个变化的分组")
+                patched = build_patched_sections(valid_groups, manifest.changed, old_sections)
+
+        if patched is None and spill and valid_groups is None:
+            if quality is None:
+                return reclassify_spilled(manifest, formats, deduplicate=not deduplicated)
+            debug_log("溢出模式: 已启用质量排序，改为在内存中分类")
+
+        if patched is not None:
+            sections, uncategorized_channels = patched
+        elif valid_groups is not None:
+            debug_log("使用内存中的频道记录进行重分类")
+            categorized_channels, uncategorized_channels = categorize_records(iter_channel_records(valid_groups))
+        else:
+            # 读取reclassify.txt文件
+            if not os.path.exists('reclassify.txt'):
+                warning_log("错误: reclassify.txt 文件不存在")
+                return False
+
+            with open('reclassify.txt', 'r', encoding='utf-8') as f:
+                content = f.read()
+
+            if not content:
+                warning_log("错误: reclassify.txt 文件为空")
+                return False
+
+            # 解析频道行
+            formatted_channels = [line.strip() for line in content.split('\n') if line.strip()]
+            debug_log(f"从 reclassify.txt 读取到 {len(formatted_channels)} 个频道")
+
+            if not formatted_channels:
+                warning_log("错误: reclassify.txt 中没有有效的频道行")
+                return False
+
+            # 重分类
+            categorized_channels, uncategorized_channels = categorize_channels(formatted_channels)
+
+        if patched is None:
+            if not categorized_channels and not uncategorized_channels:
+                warning_log("错误: 重分类后没有频道")
+                return False
+            sections, uncategorized_channels = build_result_sections(categorized_channels, uncategorized_channels,
+                                                                     quality, top_k)
+
         # 生成result.txt文件
-        with open('result.txt', 'w', encoding='utf-8') as f:
-            # 写入文件头
-            f.write(f"# 直播源重分类结果\n")
-            f.write(f"# 生成时间: {beijing_time} (北京时间)\n")
-            f.write(f"# 数据来源: https://github.com/q1017673817/iptvz/blob/main/zubo_all.txt\n\n")
-            
-            # 按照CATEGORY_MAPPING的顺序输出分类
-            for category in CATEGORY_MAPPING.keys():
-                if category in categorized_channels and categorized_channels[category]:
-                    f.write(f"{category}\n")
-                    for channel in categorized_channels[category]:
-                        f.write(f"{channel}\n")
-                    f.write("\n")
-            
-            # 添加未分类的频道
-            if uncategorized_channels:
-                f.write('其他频道,#genre#\n')
-                for channel in uncategorized_channels:
-                    f.write(f"{channel}\n")
-        
+        exporters = build_exporters(formats)
+        export_sections(sections, uncategorized_channels, exporters)
+        result_digest = exporters[0].digest.hexdigest()
+        if manifest is not None:
+            manifest.rules = rules_hash()
+            manifest.result = result_digest
+
         debug_log("=== 重分类完成 ===")
-        debug_log(f"已分类频道数: {sum(len(channels) for channels in categorized_channels.values())}")
+        debug_log(f"已分类频道数: {sum(len(channels) for _, channels in sections)}")
         debug_log(f"未分类频道数: {len(uncategorized_channels)}")
-        debug_log(f"生成文件: result.txt")
-        
+
         return True
-        
+
     except Exception as e:
-        debug_log(f"重分类过程中发生错误: {e}")
-        import traceback
-        traceback.print_exc()
+        warning_log(f"重分类过程中发生错误: {e}", exc_info=True)
         return False
 
-def main():
+def upstreams_complete(responses):
+    """检查是否所有上游都已成功响应；有失败的上游时关闭其余响应并返回False"""
+    failed = [url for url, response in responses.items() if response is None]
+    if not failed:
+        return True
+    warning_log(f"{len(failed)} 个上游下载失败，退出: {', '.join(failed)}")
+    for response in responses.values():
+        if response is not None:
+            response.close()
+    return False
+
+def run_pipeline(urls=None, incremental=False, rank=False, top_k=None, session=None, probe_cache=None, health=None,
+                 formats=EXPORT_FORMATS, spill=False, profiler=None, sample_size=GROUP_SAMPLE_SIZE,
+                 quorum=GROUP_QUORUM, per_channel=VALIDATE_EACH_CHANNEL):
+    """
+    完整运行一次：下载、检测、生成reclassify.txt和result.txt
+    服务模式下传入复用的会话、探测缓存和主机健康状态；成功或上游未变化时返回True
+    传入profiler时按阶段做性能剖析
+    sample_size/quorum/per_channel为分组有效性的判定方式（每组抽检数、判定有效所需的有效数、逐频道检测）
+    """
     # 原始文件URL
-    url = "https://raw.githubusercontent.com/q1017673817/iptvz/main/zubo_all.txt"
+    urls = urls or UPSTREAM_URLS
     
-    try:
-        debug_log("=== 开始处理 ===")
-        start_time = time.time()
-        
-        debug_log("步骤1: 下载文件...")
-        content = download_file(url)
-        if not content:
-            debug_log("下载失败，退出")
-            return
-        
-        debug_log("步骤2: 处理内容...")
-        lines = process_content(content)
-        if not lines:
-            debug_log("处理内容后没有有效行，退出")
-            return
-        
-        debug_log("步骤3: 解析分组...")
-        groups = parse_groups(lines)
-        if not groups:
-            debug_log("没有解析出任何分组，退出")
-            return
-        
-        debug_log("步骤4: 多线程检测流有效性...")
-        valid_groups = filter_valid_groups(groups, max_workers=10)
-        if not valid_groups:
-            debug_log("没有有效的分组，退出")
-            return
-        
-        debug_log("步骤5: 生成输出文件...")
-        output_content = generate_output(valid_groups)
-        
-        # 写入reclassify.txt文件
-        with open('reclassify.txt', 'w', encoding='utf-8') as f:
-            f.write(output_content)
-        
-        channel_count = len(output_content.splitlines())
-        end_time = time.time()
-        processing_time = end_time - start_time
-        
-        debug_log(f"=== 第一阶段完成！ ===")
-        debug_log(f"处理时间: {processing_time:.2f} 秒")
-        debug_log(f"有效分组: {len(valid_groups)} 个")
-        debug_log(f"总频道数: {channel_count} 个")
-        debug_log(f"生成文件: reclassify.txt")
-        
-        # 第二阶段：重分类生成result.txt
-        debug_log("\n" + "="*50)
-        reclassify_success = reclassify_reclassify_txt()
+    debug_log("=== 开始处理 ===")
+    start_time = time.time()
+    metrics = Metrics(profiler)
+    
+    debug_log(f"步骤1: 并发请求 {len(urls)} 个上游...")
+    session = session or create_session(len(urls))
+    upstream_state = load_upstream_state()
+    with metrics.stage('download'):
+        responses = fetch_upstreams(session, urls, upstream_state)
+    
+    # 任一上游下载失败都不生成结果：缺少其分组的结果不完整，也不能记录其他上游的版本
+    available = responses
+    if not upstreams_complete(available):
+        return False
+    settings = output_settings(formats, rank, top_k, sample_size, quorum, per_channel)
+    if all(response.status_code == 304 for response in available.values()):
+        if upstream_state.get(OUTPUT_STATE_KEY) == settings:
+            debug_log("所有上游均未变化，跳过检测和重分类")
+            metrics.counters['upstreams_unchanged'] = len(available)
+            metrics.write(METRICS_FILE)
+            return True
+        debug_log("所有上游均未变化，但分类规则或输出设置已变化，重新生成结果")
+    
+    # 部分上游未变化时仍需要它们的内容来生成完整结果，重新无条件下载
+    for url, response in available.items():
+        if response.status_code == 304:
+            response.close()
+            with metrics.stage('download'):
+                available[url] = open_upstream(session, url)
+    if not upstreams_complete(available):
+        return False
+    
+    # 下载、解析、检测以流水线方式进行：分组一解析出来就开始探测
+    debug_log("步骤2-4: 流式下载、解析分组并检测流有效性...")
+    lines = itertools.chain.from_iterable(
+        iter_content_lines(metrics.timed_iter('download', iter_response_lines(response)))
+        for response in available.values()
+    )
+    if probe_cache is None:
+        probe_cache = ProbeCache().load()
+    else:
+        probe_cache.begin_run()
+    if health is None:
+        health = HostHealth().load()
+    else:
+        health.begin_run()
+    manifest = GroupManifest().load() if incremental else None
+    deduplicator = ChannelDeduplicator()
+    with metrics.profile('parse_probe'):
+        groups, valid_groups = stream_valid_groups(lines, cache=probe_cache, sample_size=sample_size, quorum=quorum,
+                                                   per_channel=per_channel, manifest=manifest, metrics=metrics,
+                                                   health=health, deduplicator=deduplicator)
+    metrics.counters['duplicates_dropped'] = deduplicator.dropped
+    metrics.counters['duplicate_url_conflicts'] = deduplicator.conflicts
+    probe_cache.save()
+    health.save()
+    if not groups:
+        debug_log("没有解析出任何分组，退出")
+        return False
+    if not valid_groups:
+        debug_log("没有有效的分组，退出")
+        return False
+    
+    debug_log("步骤5: 生成输出文件...")
+    # 写入reclassify.txt文件
+    with metrics.stage('generate'):
+        channel_count = write_output(valid_groups, 'reclassify.txt')
+    
+    end_time = time.time()
+    processing_time = end_time - start_time
+    
+    debug_log(f"=== 第一阶段完成！ ===")
+    debug_log(f"处理时间: {processing_time:.2f} 秒")
+    debug_log(f"有效分组: {len(valid_groups)} 个")
+    debug_log(f"总频道数: {channel_count} 个")
+    debug_log(f"生成文件: reclassify.txt")
+    
+    quality = None
+    if rank:
+        with metrics.stage('quality'):
+            quality = measure_quality(valid_groups, metrics=metrics)
+        write_quality(quality)
+    
+    # 第二阶段：重分类生成result.txt
+    debug_log("\n" + "="*50)
+    if spill and quality is None:
+        # 溢出模式：频道已写入reclassify.txt，释放内存中的分组和去重记录，从文件逐行分类
+        debug_log("溢出模式: 释放内存中的分组，从 reclassify.txt 逐行分类")
+        groups = valid_groups = deduplicator = None
+    # 否则直接使用内存中的有效分组，reclassify.txt 只作为产物保留
+    with metrics.stage('categorize'):
+        reclassify_success = reclassify_reclassify_txt(valid_groups, manifest, quality, top_k, formats, spill,
+                                                       deduplicated=True)
+    
+    if reclassify_success:
+        debug_log("=== 全部处理完成！ ===")
+        debug_log("生成的文件:")
+        debug_log("- reclassify.txt (原始分类文件)")
+        debug_log("- result.txt (重分类后的文件)")
         
-        if reclassify_success:
-            debug_log("=== 全部处理完成！ ===")
-            debug_log("生成的文件:")
-            debug_log("- reclassify.txt (原始分类文件)")
-            debug_log("- result.txt (重分类后的文件)")
-            
-            # 检查文件是否真的生成
-            if os.path.exists('result.txt'):
-                with open('result.txt', 'r', encoding='utf-8') as f:
-                    tv_content = f.read()
-                debug_log(f"result.txt 文件大小: {len(tv_content)} 字符")
-                debug_log(f"result.txt 行数: {len(tv_content.splitlines())}")
-            else:
-                debug_log("错误: result.txt 文件未生成")
+        # 检查文件是否真的生成
+        if os.path.exists('result.txt'):
+            with open('result.txt', 'r', encoding='utf-8') as f:
+                tv_content = f.read()
+            debug_log(f"result.txt 文件大小: {len(tv_content)} 字符")
+            debug_log(f"result.txt 行数: {len(tv_content.splitlines())}")
         else:
-            debug_log("=== 重分类失败 ===")
+            warning_log("错误: result.txt 文件未生成")
+        
+        # 结果生成成功后才记录上游版本，失败的运行下次会重新处理
+        for url, response in available.items():
+            upstream_state[url] = response_validators(response)
+        upstream_state[OUTPUT_STATE_KEY] = settings
+        save_upstream_state(upstream_state)
+        if manifest is not None:
+            manifest.save()
         
+        metrics.add_stage_time('total', time.time() - start_time)
+        metrics.counters['channels'] = channel_count
+        metrics.write(METRICS_FILE)
+    else:
+        warning_log("=== 重分类失败 ===")
+    return reclassify_success
+
+def main(urls=None, incremental=False, rank=False, top_k=None, formats=EXPORT_FORMATS, spill=False, profiler=None,
+         sample_size=GROUP_SAMPLE_SIZE, quorum=GROUP_QUORUM, per_channel=VALIDATE_EACH_CHANNEL):
+    try:
+        success = run_pipeline(urls, incremental, rank, top_k, formats=formats, spill=spill, profiler=profiler,
+                               sample_size=sample_size, quorum=quorum, per_channel=per_channel)
     except Exception as e:
-        debug_log(f"错误: {e}")
-        import traceback
-        traceback.print_exc()
+        warning_log(f"错误: {e}", exc_info=True)
         exit(1)
+    finally:
+        if profiler is not None:
+            profiler.write()
+    if not success:
+        # 没有生成结果（如上游下载失败），以非零状态退出，定时任务会显示为失败
+        sys.exit(1)
+
+class ResultStore:
+    """
+    服务模式下对外提供的文件快照（内容、gzip压缩内容、ETag、修改时间）
+    每次刷新后构建新的快照再整体替换引用，请求线程看到的总是某一次完整的结果
+    """
+
+    def __init__(self, paths=SERVE_FILES):
+        self.paths = paths
+        self.files = {}
+
+    def reload(self):
+        files = {}
+        for path in self.paths:
+            try:
+                with open(path, 'rb') as f:
+                    body = f.read()
+                modified = os.path.getmtime(path)
+            except OSError:
+                continue
+            files['/' + os.path.basename(path)] = {
+                'body': body,
+                'gzip': gzip.compress(body),
+                'etag': '"' + hashlib.sha1(body).hexdigest() + '"',
+                'last_modified': formatdate(modified, usegmt=True),
+                'content_type': SERVE_CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream'),
+            }
+        self.files = files
+        debug_log(f"服务文件已更新: {', '.join(sorted(files)) or '无'}")
+
+class ResultRequestHandler(http.server.BaseHTTPRequestHandler):
+    """只读文件服务：支持HEAD、ETag条件请求和gzip压缩"""
+    server_version = "reclassify"
+
+    def do_GET(self):
+        self.respond(include_body=True)
+
+    def do_HEAD(self):
+        self.respond(include_body=False)
+
+    def accepts_gzip(self):
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = coding.strip().partition(';')
+            if name.strip().lower() == 'gzip':
+                return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+        return False
+
+    def respond(self, include_body):
+        entry = self.server.store.files.get(urlsplit(self.path).path)
+        if entry is None:
+            self.send_error(404)
+            return
+
+        use_gzip = self.accepts_gzip()
+        # 压缩和未压缩的内容使用不同的ETag
+        etag = entry['etag'][:-1] + '-gzip"' if use_gzip else entry['etag']
+        if_none_match = [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]
+        if etag in if_none_match or '*' in if_none_match:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        body = entry['gzip'] if use_gzip else entry['body']
+        self.send_response(200)
+        self.send_header('Content-Type', entry['content_type'])
+        self.send_header('Content-Length', str(len(body)))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', entry['last_modified'])
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        verbose_log("HTTP %s " + format, self.address_string(), *args)
+
+def start_result_server(store, host=SERVE_HOST, port=SERVE_PORT):
+    """在后台线程中启动HTTP服务"""
+    server = http.server.ThreadingHTTPServer((host, port), ResultRequestHandler)
+    server.store = store
+    threading.Thread(target=server.serve_forever, name="result-server", daemon=True).start()
+    debug_log(f"HTTP服务已启动: http://{host}:{server.server_address[1]}/")
+    return server
+
+def serve(urls=None, host=SERVE_HOST, port=SERVE_PORT, interval=SERVE_INTERVAL, jitter=SERVE_JITTER,
+          incremental=False, rank=False, top_k=None, formats=EXPORT_FORMATS, spill=False,
+          sample_size=GROUP_SAMPLE_SIZE, quorum=GROUP_QUORUM, per_channel=VALIDATE_EACH_CHANNEL):
+    """
+    服务模式：按间隔（带随机抖动）定时刷新，并通过本地HTTP服务提供最新的结果文件
+    规则索引、HTTP会话、探测缓存和主机健康状态在多次刷新之间保持
+    """
+    urls = urls or UPSTREAM_URLS
+    store = ResultStore()
+    store.reload()
+    server = start_result_server(store, host, port)
+
+    session = create_session(len(urls))
+    probe_cache = ProbeCache().load()
+    health = HostHealth().load()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    try:
+        while not stop.is_set():
+            try:
+                if run_pipeline(urls, incremental, rank, top_k, session, probe_cache, health, formats, spill,
+                                sample_size=sample_size, quorum=quorum, per_channel=per_channel):
+                    store.reload()
+            except Exception as e:
+                warning_log(f"刷新失败: {e}", exc_info=True)
+
+            delay = interval * (1 + random.uniform(-jitter, jitter))
+            debug_log(f"下次刷新在 {delay:.0f} 秒后")
+            stop.wait(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        session.close()
+        debug_log("服务已停止")
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="下载直播源、检测有效性并重新分类")
+    parser.add_argument('urls', nargs='*', help="上游直播源地址（默认使用UPSTREAM_URLS）")
+    parser.add_argument('--incremental', action='store_true',
+                        help="增量模式：只检测和重分类变化的分组")
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='summary',
+                        help="日志级别：quiet只输出警告和错误，summary输出阶段汇总，verbose输出每次探测")
+    parser.add_argument('--log-json', action='store_true', help="以JSON-lines格式输出日志")
+    parser.add_argument('--serve', action='store_true',
+                        help="服务模式：定时刷新并通过本地HTTP服务提供result.txt和reclassify.txt")
+    parser.add_argument('--host', default=SERVE_HOST, help="服务模式的监听地址")
+    parser.add_argument('--port', type=int, default=SERVE_PORT, help="服务模式的监听端口")
+    parser.add_argument('--interval', type=float, default=SERVE_INTERVAL, help="服务模式的刷新间隔（秒）")
+    parser.add_argument('--jitter', type=float, default=SERVE_JITTER, help="刷新间隔的随机抖动比例（0-1）")
+    parser.add_argument('--formats', nargs='+', choices=EXPORTERS, default=list(EXPORT_FORMATS),
+                        help="生成的结果格式（result.txt总会生成）")
+    parser.add_argument('--spill', action='store_true',
+                        help="写出reclassify.txt后释放内存中的频道记录，从文件逐行分类，分类结果写入临时文件。"
+                             "检测阶段仍需全部频道记录；与 --rank 同时使用时不生效")
+    parser.add_argument('--compile-rules', action='store_true',
+                        help=f"重新编译规则文件 {os.path.basename(RULES_FILE)} 后退出")
+    parser.add_argument('--rank', action='store_true',
+                        help="测量每个播放地址的首字节时间、码率和分辨率，同名频道按速度排序")
+    parser.add_argument('--top-k', type=int, default=None,
+                        help="每个频道最多保留的地址数（隐含--rank）")
+    parser.add_argument('--sample-size', type=int, default=GROUP_SAMPLE_SIZE,
+                        help="每个分组最多抽检的频道数（并发检测，达到判定结果即停止）")
+    parser.add_argument('--quorum', type=int, default=GROUP_QUORUM,
+                        help="抽检中判定分组有效所需的有效频道数")
+    parser.add_argument('--per-channel', action='store_true', default=VALIDATE_EACH_CHANNEL,
+                        help="逐个检测每个频道，只保留有效频道，每个频道的结果写入metrics.json")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"性能剖析：按阶段输出热点函数和内存分配位置到 {PROFILE_DIR}/ 目录")
+    parser.add_argument('--profile-dir', default=PROFILE_DIR, help="性能剖析报告的输出目录")
+    parser.add_argument('--flamegraph', metavar='PATH', default=None,
+                        help="同时采样调用栈，写出火焰图工具（flamegraph.pl、speedscope）可用的折叠栈文件（隐含--profile）")
+    args = parser.parse_args(argv)
+    if args.sample_size < 1:
+        parser.error("--sample-size 必须大于0")
+    if not 1 <= args.quorum <= args.sample_size:
+        parser.error("--quorum 必须在1和--sample-size之间")
+    if args.flamegraph:
+        args.profile = True
+    if args.top_k is not None:
+        if args.top_k < 1:
+            parser.error("--top-k 必须大于0")
+        args.rank = True
+    return args
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    configure_logging(args.log_level, args.log_json)
+    if args.compile_rules:
+        load_rules(force=True)
+        sys.exit(0)
+    if args.serve:
+        serve(args.urls, args.host, args.port, args.interval, args.jitter,
+              incremental=args.incremental, rank=args.rank, top_k=args.top_k, formats=args.formats,
+              spill=args.spill, sample_size=args.sample_size, quorum=args.quorum, per_channel=args.per_channel)
+        sys.exit(0)
+    profiler = StageProfiler(args.profile_dir, args.flamegraph) if args.profile else None
+    main(args.urls, incremental=args.incremental, rank=args.rank, top_k=args.top_k, formats=args.formats,
+         spill=args.spill, profiler=profiler, sample_size=args.sample_size, quorum=args.quorum,
+         per_channel=args.per_channel)